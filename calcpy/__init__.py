@@ -19,7 +19,10 @@ from time import perf_counter
 from . import currency
 from . import formatters
 from . import transformers
+from . import codecache
+from . import pool
 from . import info
+from . import infocache
 from . import autostore
 import previewer
 
@@ -37,6 +40,17 @@ class CalcPy(IPython.core.magic.Magics):
     auto_solve = traitlets.Bool(True, config=True, help="convert 'x+1=0' to solve(Eq(x+1,0))")
     auto_expand_factor_poly = traitlets.Bool(True, config=True, help="expand/factor polynomials")
     auto_evalf = traitlets.Bool(True, config=True, help="evalute expressions")
+    evalf_budget = traitlets.Float(3, config=True, help="time limit (seconds) for evaluating displayed results (the '≈' line), 0 for no limit")
+    evalf_overrun = traitlets.Enum(['defer', 'skip'], 'defer', config=True, help="evaluation over time limit, 'defer' - print when done, 'skip' - don't print")
+    simplify_ladder = traitlets.List(traitlets.Enum(['nsimplify', 'cancel', 'together', 'trigsimp', 'simplify']), ['cancel', 'together', 'trigsimp', 'simplify'],
+                                     config=True, help="simplification steps of evaluated results, cheap to expensive")
+    evalf_processes = traitlets.Int(0, config=True, help="processes for evaluating lists and dictionaries of results in parallel, 0 to evaluate serially")
+    evalf_processes_budget = traitlets.Float(10, config=True, help="time limit (seconds) for parallel evaluation, elements not done are shown as is, 0 for no limit")
+    info_processes = traitlets.Int(2, config=True, help="processes for the analyses of '?', 0 to analyze in a thread (no time limit)")
+    info_timeout = traitlets.Float(10, config=True, help="time limit (seconds) for each analysis of '?', 0 for no limit")
+    info_numeric_matrix_size = traitlets.Int(8, config=True, help="matrices of numbers with more rows or columns are analyzed numerically (numpy) by '?', exact rational ones also symbolically")
+    info_cache_size = traitlets.Float(50, config=True, help="size limit (MB) of the persistent cache of results of '?', 0 to disable")
+    numpy_sympy_max_size = traitlets.Int(100, config=True, help="numpy arrays up to this size are shown as sympy matrices (evaluated), larger are summarized by numpy")
     auto_lambda = traitlets.Bool(True, config=True, help="convert 'f(x,y):=x+y' to 'f=lambda x,y : x+y'")
     auto_store = traitlets.Bool(True, config=True, help="enable automatic store/restore of variables and functions")
     auto_matrix = traitlets.Bool(True, config=True, help="convert tuples of tuples to matrices")
@@ -51,6 +65,8 @@ class CalcPy(IPython.core.magic.Magics):
     uniform_assumptions = traitlets.Bool(True, config=True, help="uniform assumption per name for symbolic variables")
     previewer = traitlets.Bool(True, config=True, help="enable previewer")
     bitwidth = traitlets.Int(0, config=True, help="bitwidth of displayed binary integers, if 0 adjusted accordingly")
+    big_int_bits = traitlets.Int(4096, config=True, help="integers longer than this (bits) are shown by digit count, leading/trailing digits and scientific notation, 0 to show all digits")
+    truncate_output = traitlets.Bool(True, config=True, help="render only the part of big results that fits the terminal (top-left of matrices, first and last terms of sums), show_full() to show all")
     chop = traitlets.Bool(True, config=True, help="replace small numbers with zero")
     units_prefixes = traitlets.Bool(False, config=True, help="units prefixes (e.g. 2k=2000)")
     gui = traitlets.Unicode('auto', config=True, allow_none=True, help="matplotlib gui backend, set None to skip")
@@ -106,8 +122,33 @@ class CalcPy(IPython.core.magic.Magics):
                 for key in self._units_prefixes_dict:
                     self.shell.user_ns.pop(key, None)
                     self.shell.user_ns_hidden.pop(key, None)
+                try:
+                    self._ns_index.update(self._units_prefixes_dict)
+                except AttributeError:
+                    pass
         self.observe(_units_prefixes_changed, names='units_prefixes')
 
+        def _evalf_processes_changed(change):
+            try:
+                self._pool.resize(change.new)
+            except AttributeError:
+                pass
+        self.observe(_evalf_processes_changed, names='evalf_processes')
+
+        def _info_processes_changed(change):
+            try:
+                self._info_pool.resize(change.new)
+            except AttributeError:
+                pass
+        self.observe(_info_processes_changed, names='info_processes')
+
+        def _info_cache_size_changed(change):
+            try:
+                self._info_cache.maxsize = int(change.new * 2**20)
+            except AttributeError:
+                pass
+        self.observe(_info_cache_size_changed, names='info_cache_size')
+
         def _gui_changed(change):
             if change.old != change.new:
                 shell.enable_matplotlib(shell.calcpy.gui)
@@ -127,11 +168,23 @@ class CalcPy(IPython.core.magic.Magics):
 
     def push(self, variables, interactive=True):
         self.shell.push(variables, interactive)
+        try:
+            self._ns_index.update(variables)
+        except AttributeError:
+            pass
         try:
             self.shell.previewer.push(variables)
         except AttributeError:
             pass
 
+    def cache_info(self):
+        return {'transform': transformers._raw_code_transformer.cache_info(),
+                'code': self._code_cache.info(),
+                'latex': transformers._parse_latex.cache_info(),
+                'evalf': formatters._evalf.cache_info(),
+                'render': formatters._render_cache.info(),
+                'info': self._info_cache.info()}
+
     def __repr__(self):
         config = self.trait_values(config=True)
         return 'CalcPy ' + repr(config)
@@ -142,7 +195,7 @@ class CalcPy(IPython.core.magic.Magics):
     def reset(self, prompt=True):
         if (not prompt) or (input("Reset CalcPy configuration? [y/N] ").lower() in ["y","yes"]):
             for trait_name, trait in sorted(self.traits(config=True).items()):
-                setattr(self, trait_name, trait.default_value)
+                setattr(self, trait_name, self.trait_defaults(trait_name))
         self.shell.autostore.reset(prompt)
 
     def load_previewer(self):
@@ -178,6 +231,9 @@ https://github.com/idanpa/calcpy''')
 
     formatters.init(ip)
     transformers.init(ip)
+    codecache.init(ip)
+    pool.init(ip)
+    infocache.init(ip)
     info.init(ip)
     currency.init(ip)
 
@@ -0,0 +1,222 @@
+import ast
+import os
+import io
+import sys
+import json
+import argparse
+import platform
+import warnings
+import tempfile
+import contextlib
+from time import perf_counter
+import IPython
+import sympy
+import numpy
+
+from . import formatters
+from . import transformers
+from . import info
+from . import infocache
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEMO_SCENARIO_PATH = os.path.join(PACKAGE_DIR, '..', 'docs', 'demo', 'demo_scenario.txt')
+TEST_OUTPUT_PATH = os.path.join(PACKAGE_DIR, 'tests', 'test_output.py')
+REGRESSION_RATIO = 1.2
+
+# long pasted inputs:
+LONG_CELLS = {
+    'polynomial': '\n'.join(' + '.join(f'{i}x^{i}' for i in range(j, j+100)) for j in range(1, 2000, 100)),
+    'table': '[' + ',\n'.join(f'({i}, {i}.5, 2e{i%10}, {i}MB)' for i in range(1000)) + ']',
+    'script': '\n'.join(f'a_{i} = {i}(x+1)² + √{i}y' for i in range(1000)),
+    'strings': '[' + ',\n'.join(f'("item {i}", \'{i}x\', f"{{{i}x}}", $x^{i%10}$, {i}x)' for i in range(1, 501)) + ']',
+}
+
+# big matrices, evaluated numerically:
+MATRICES = {
+    'irrational 50x50': lambda: sympy.Matrix(50, 50, lambda i, j: sympy.sqrt(i+j) + sympy.Rational(i, j+1)),
+    'float+pi 50x50': lambda: sympy.Matrix(50, 50, lambda i, j: sympy.Float(i/(j+1)) + sympy.pi),
+    'irrational 200x200': lambda: sympy.Matrix(200, 200, lambda i, j: sympy.sqrt(i+j) + sympy.Rational(i, j+1)),
+}
+
+# matrices of numbers analyzed by '?' (numerically over calcpy.info_numeric_matrix_size):
+INFO_MATRIX_SIZES = (5, 10, 20, 50, 100)
+
+def info_matrix(n):
+    return sympy.Matrix(numpy.random.default_rng(0).random((n, n)))
+
+def demo_cells():
+    # commands typed in the demo ('$> command')
+    if not os.path.isfile(DEMO_SCENARIO_PATH):
+        return []
+    with open(DEMO_SCENARIO_PATH, 'r', encoding='utf-8') as f:
+        return [line[3:].strip() for line in f if line.startswith('$> ')]
+
+def run_flow_cells():
+    # run_cell('...') calls of test_output.run_flow
+    if not os.path.isfile(TEST_OUTPUT_PATH):
+        return []
+    with open(TEST_OUTPUT_PATH, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    cells = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef) and node.name == 'run_flow':
+            for call in ast.walk(node):
+                if isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id == 'run_cell' and \
+                   len(call.args) == 1 and isinstance(call.args[0], ast.Constant):
+                    cells.append(call.args[0].value)
+    return cells
+
+def corpus():
+    cells = {}
+    for cell in demo_cells():
+        cells[f'demo: {cell}'] = cell
+    for cell in run_flow_cells():
+        cells[f'run_flow: {cell}'] = cell
+    for name, cell in LONG_CELLS.items():
+        cells[f'synthetic: {name}'] = cell
+    return cells
+
+def time_it(func, n):
+    # best of n, in ms
+    best = float('inf')
+    for i in range(n):
+        start_time = perf_counter()
+        func()
+        best = min(best, perf_counter() - start_time)
+    return 1e3 * best
+
+def cell_results(ip, cells):
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        for label, cell in cells.items():
+            # info is timed separately
+            res = ip.run_cell(cell.rstrip('?'), store_history=False).result
+            if res is not None:
+                results[label] = res
+    return results
+
+def run(ip, n=5, info_n=1):
+    # python might warn about the syntax hacks
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', category=SyntaxWarning)
+        return _run(ip, n, info_n)
+
+def _run(ip, n, info_n):
+    cells = corpus()
+    timings = {}
+
+    def raw_code_transformer(cell):
+        transformers._raw_code_transformer.cache_clear()
+        transformers.raw_code_transformer(cell)
+    timings['raw_code_transformer'] = {label: time_it(lambda: raw_code_transformer(cell), n) for label, cell in cells.items()}
+
+    for transformer in ip.ast_transformers:
+        timings[type(transformer).__name__] = transformer_timings = {}
+        for label, cell in cells.items():
+            try:
+                code = transformers.raw_code_transformer(cell.rstrip('?'))
+                trees = [ast.parse(code) for i in range(n)]
+            except SyntaxError:
+                continue
+            with contextlib.redirect_stdout(io.StringIO()):
+                transformer_timings[label] = time_it(lambda: transformer.visit(trees.pop()), n)
+
+    results = cell_results(ip, cells)
+    exprs = {label: res for label, res in results.items() if isinstance(res, (sympy.Expr, sympy.matrices.MatrixBase))}
+    def uncached(func):
+        def uncached_func(obj):
+            formatters._evalf.cache_clear()
+            formatters._render_cache.clear()
+            return func(obj)
+        return uncached_func
+    evalf = uncached(formatters.evalf)
+    previewer_formatter = uncached(formatters.previewer_formatter)
+    timings['evalf'] = {label: time_it(lambda: evalf(res), n) for label, res in exprs.items()}
+    matrices = {label: matrix() for label, matrix in MATRICES.items()}
+    timings['evalf_matrix'] = {label: time_it(lambda: evalf(matrix), n) for label, matrix in matrices.items()}
+    timings['evalf_cached'] = {label: time_it(lambda: formatters.evalf(res), n) for label, res in exprs.items()}
+    pretty = uncached(formatters.pretty)
+    timings['pretty'] = {label: time_it(lambda: pretty(res), n) for label, res in results.items()}
+    timings['pretty_cached'] = {label: time_it(lambda: formatters.pretty(res), n) for label, res in results.items()}
+    timings['previewer_formatter'] = {label: time_it(lambda: previewer_formatter(res), n) for label, res in results.items()}
+
+    info_results = {label: res for label, res in results.items() if not label.startswith('synthetic')}
+    info_cache = ip.calcpy._info_cache
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as cache_dir:
+            ip.calcpy._info_cache = infocache.InfoCache(os.path.join(cache_dir, infocache.INFO_CACHE_FILE_NAME), 0)
+            timings['print_info_job'] = {label: time_it(lambda: info.print_info_job(res), info_n) for label, res in info_results.items()}
+            ip.calcpy._info_cache.maxsize = info_cache.maxsize
+            for res in info_results.values():
+                info.print_info_job(res)
+            timings['print_info_job_cached'] = {label: time_it(lambda: info.print_info_job(res), info_n) for label, res in info_results.items()}
+            ip.calcpy._info_cache.maxsize = 0
+            info_matrices = {f'{n}x{n}': info_matrix(n) for n in INFO_MATRIX_SIZES}
+            timings['print_info_job_matrix'] = {label: time_it(lambda: info.print_info_job(matrix), info_n) for label, matrix in info_matrices.items()}
+            ip.calcpy._info_cache.close()
+    finally:
+        ip.calcpy._info_cache = info_cache
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'ipython': IPython.__version__,
+            'sympy': sympy.__version__,
+            'n': n,
+        },
+        'results': {subsystem: {'total_ms': sum(items.values()), 'items': items} for subsystem, items in timings.items()},
+    }
+
+def compare(report, baseline, ratio=REGRESSION_RATIO):
+    # per subsystem total, flags regressions
+    lines = [f'{"subsystem":<28} {"baseline ms":>12} {"current ms":>12} {"ratio":>7}']
+    regressions = []
+    for subsystem, result in report['results'].items():
+        total = result['total_ms']
+        if subsystem not in baseline['results']:
+            lines.append(f'{subsystem:<28} {"-":>12} {total:12.3f} {"-":>7}')
+            continue
+        base_total = baseline['results'][subsystem]['total_ms']
+        r = total / base_total if base_total else float('inf')
+        mark = ''
+        if r > ratio:
+            mark = ' !'
+            regressions.append(subsystem)
+        lines.append(f'{subsystem:<28} {base_total:12.3f} {total:12.3f} {r:7.2f}{mark}')
+    return '\n'.join(lines), regressions
+
+def summary(report):
+    lines = [f'{"subsystem":<28} {"items":>6} {"total ms":>12}']
+    for subsystem, result in report['results'].items():
+        lines.append(f'{subsystem:<28} {len(result["items"]):>6} {result["total_ms"]:12.3f}')
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m calcpy.bench', description='CalcPy micro-benchmarks')
+    parser.add_argument('-n', type=int, default=5, help='repetitions per item (best is taken)')
+    parser.add_argument('-o', '--output', help='write results json to this path')
+    parser.add_argument('-b', '--baseline', help='compare to results json of a previous run')
+    args = parser.parse_args()
+
+    from IPython.testing.globalipapp import start_ipython
+    ip = start_ipython()
+    ip.config.CalcPy.previewer = False
+    ip.run_line_magic('load_ext', 'calcpy')
+
+    report = run(ip, args.n)
+    print(summary(report))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        comparison, regressions = compare(report, baseline)
+        print(comparison)
+        if regressions:
+            print(f'regressions: {", ".join(regressions)}')
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
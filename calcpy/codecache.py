@@ -0,0 +1,204 @@
+import ast
+import types
+import collections
+import IPython
+import sympy
+
+from . import transformers
+
+CODE_CACHE_SIZE = 128
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+undefined = object()
+
+def name_kind(value):
+    # what the ast transformations check about the value of a name
+    if value is undefined:
+        return 'undefined'
+    if value is sympy.Rational:
+        return 'Rational'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, (sympy.Expr, float, complex)):
+        return 'number'
+    if isinstance(value, (transformers.FactorialPow, transformers.SqrtMul)):
+        return 'operator'
+    return 'other'
+
+def code_with_filename(code, filename):
+    # code objects are compiled with the cell name, used by tracebacks
+    if code.co_filename == filename:
+        return code
+    consts = tuple(code_with_filename(c, filename) if isinstance(c, types.CodeType) else c for c in code.co_consts)
+    return code.replace(co_filename=filename, co_consts=consts)
+
+class CachedCell():
+    def __init__(self, key, cell):
+        self.key = key # without namespace version
+        self.cell = cell # transformed cell
+        self.is_async = None
+        self.tree = None # parsed, before ast transformations
+        self.body = None # after ast transformations
+        self.node_ids = set()
+        self.names = ()
+        self.kinds = ()
+        self.assigned_names = set()
+        self.codes = {} # (node id, mode, compiler flags): (code, compiler flags after)
+        self.version = None # namespace index version
+
+    def valid(self, user_ns):
+        return all(name_kind(user_ns.get(name, undefined)) == kind for name, kind in zip(self.names, self.kinds))
+
+class CachedCompiler():
+    # compiler of a cached cell, compile each node once
+    def __init__(self, compiler, cached):
+        self.compiler = compiler
+        self.cached = cached
+
+    def __getattr__(self, name):
+        return getattr(self.compiler, name)
+
+    def __call__(self, source, filename, symbol):
+        node = source.body[0]
+        if id(node) not in self.cached.node_ids: # added by ipython (last_expr_or_assign)
+            return self.compiler(source, filename, symbol)
+        key = (id(node), symbol, self.compiler.flags)
+        if key in self.cached.codes:
+            code, self.compiler.flags = self.cached.codes[key]
+            return code_with_filename(code, filename)
+        code = self.compiler(source, filename, symbol)
+        self.cached.codes[key] = (code, self.compiler.flags)
+        return code
+
+class CodeCache():
+    # compiled cells by raw cell, transformations configuration and namespace index version,
+    # a repeated cell skips the input transformers, parsing, ast transformers and compilation.
+    # ast transformations depend also on the types of names (e.g. division of int names), validated on lookup
+    def __init__(self, ip, maxsize=CODE_CACHE_SIZE):
+        self.ip = ip
+        self.maxsize = maxsize
+        self.cells = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.entry = None # cached cell being executed
+        self.tree = None # its ast
+        self.pending = None # cell to cache, once transformed
+
+        self.transform_cell_orig = ip.transform_cell
+        self.should_run_async_orig = ip.should_run_async
+        self.ast_parse_orig = ip.compile.ast_parse
+        self.transform_ast_orig = ip.transform_ast
+        self.run_ast_nodes_orig = ip.run_ast_nodes
+        ip.transform_cell = self.transform_cell
+        ip.should_run_async = self.should_run_async
+        ip.compile.ast_parse = self.ast_parse
+        ip.transform_ast = self.transform_ast
+        ip.run_ast_nodes = self.run_ast_nodes
+
+    def key(self, raw_cell):
+        calcpy = self.ip.calcpy
+        if calcpy._print_transformed_code:
+            return None
+        ast_state = []
+        for transformer in self.ip.ast_transformers:
+            state = getattr(transformer, 'cache_key', undefined)
+            if state is undefined: # unknown transformer state
+                return None
+            ast_state.append(state)
+        return (raw_cell, transformers.raw_code_config(calcpy), self.ip.autocall, self.ip.automagic, tuple(ast_state))
+
+    def transform_cell(self, raw_cell):
+        self.entry = self.tree = self.pending = None
+        key = self.key(raw_cell)
+        if key is None:
+            return self.transform_cell_orig(raw_cell)
+        entry = self.cells.get(key + (self.ip.calcpy._ns_index.get_version(),))
+        if entry is not None and entry.valid(self.ip.user_ns):
+            self.cells.move_to_end(entry.key + (entry.version,))
+            self.hits += 1
+            self.entry = entry
+            return entry.cell
+        self.misses += 1
+        cell = self.transform_cell_orig(raw_cell)
+        self.pending = CachedCell(key, cell)
+        return cell
+
+    def should_run_async(self, raw_cell, *, transformed_cell=None, preprocessing_exc_tuple=None):
+        cached = self.entry or self.pending
+        if cached is None or transformed_cell is not cached.cell or preprocessing_exc_tuple is not None:
+            return self.should_run_async_orig(raw_cell, transformed_cell=transformed_cell,
+                                              preprocessing_exc_tuple=preprocessing_exc_tuple)
+        if cached.is_async is None:
+            cached.is_async = self.should_run_async_orig(raw_cell, transformed_cell=transformed_cell)
+        return cached.is_async
+
+    def ast_parse(self, source, filename='<unknown>', symbol='exec'):
+        if self.entry is not None and source is self.entry.cell:
+            # fresh body list, ipython might append to it
+            self.tree = ast.Module(list(self.entry.body), type_ignores=[])
+            return self.tree
+        tree = self.ast_parse_orig(source, filename, symbol)
+        if self.pending is not None and source is self.pending.cell:
+            self.pending.tree = tree
+        return tree
+
+    def transform_ast(self, node):
+        ns_index = self.ip.calcpy._ns_index
+        if self.entry is not None and node is self.tree:
+            # names tracking of the skipped transformation
+            if self.entry.assigned_names is None:
+                ns_index.assigned_names = None
+            elif ns_index.assigned_names is not None:
+                ns_index.assigned_names |= self.entry.assigned_names
+            return node
+
+        pending, self.pending = self.pending, None
+        if pending is None or node is not pending.tree:
+            return self.transform_ast_orig(node)
+
+        ast_transformers = list(self.ip.ast_transformers)
+        assigned_names = None if ns_index.assigned_names is None else set(ns_index.assigned_names)
+        node = self.transform_ast_orig(node)
+        if ast_transformers != self.ip.ast_transformers or not isinstance(node, ast.Module) or \
+           any(getattr(transformer, 'evaluated', False) for transformer in ast_transformers):
+            return node
+
+        pending.tree = None
+        pending.body = list(node.body)
+        pending.node_ids = {id(n) for n in pending.body}
+        pending.names = tuple({n.id for n in ast.walk(node) if isinstance(n, ast.Name)})
+        pending.kinds = tuple(name_kind(self.ip.user_ns.get(name, undefined)) for name in pending.names)
+        if assigned_names is None or ns_index.assigned_names is None:
+            pending.assigned_names = ns_index.assigned_names
+        else:
+            pending.assigned_names = ns_index.assigned_names - assigned_names
+        # version after transformation (auto symbols)
+        pending.version = ns_index.get_version()
+        key = pending.key + (pending.version,)
+        self.cells[key] = pending
+        self.cells.move_to_end(key)
+        if len(self.cells) > self.maxsize:
+            self.cells.popitem(last=False)
+        self.entry = pending
+        self.tree = node
+        return node
+
+    def run_ast_nodes(self, nodelist, cell_name, interactivity='last_expr', compiler=compile, result=None):
+        if self.entry is not None and self.tree is not None and nodelist is self.tree.body:
+            compiler = CachedCompiler(compiler, self.entry)
+        self.entry = self.tree = None
+        return self.run_ast_nodes_orig(nodelist, cell_name, interactivity, compiler, result)
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self.cells))
+
+    def clear(self):
+        self.cells.clear()
+        self.hits = 0
+        self.misses = 0
+
+def init(ip: IPython.InteractiveShell):
+    ip.calcpy._code_cache = CodeCache(ip)
@@ -1,9 +1,16 @@
-from functools import partial
+from functools import partial, lru_cache
 import re
+import sys
+import ctypes
 import shutil
 import datetime
+import threading
+import itertools
+import collections
+from time import perf_counter
 import IPython
 import IPython.lib.pretty
+import mpmath
 import numpy
 import sympy
 import sympy.core
@@ -11,9 +18,31 @@ import sympy.matrices
 import sympy.combinatorics
 from sympy.printing.pretty.pretty import PrettyPrinter
 from sympy.printing.pretty.stringpict import stringPict, prettyForm
+from sympy.printing.pretty.pretty_symbology import pretty_use_unicode
 from sympy.concrete.expr_with_limits import ExprWithLimits
+from sympy.functions.elementary.piecewise import ExprCondPair
+from sympy.printing.numpy import NumPyPrinter
+from prompt_toolkit.application import run_in_terminal
+from prompt_toolkit.application.current import set_app
 
 MAX_SEQ_LENGTH = 100
+EVALF_CACHE_SIZE = 1024
+EVALF_OVERRUNS_LOG_SIZE = 100
+EVALF_PARALLEL_MIN_ITEMS = 16
+EVALF_PARALLEL_MIN_OPS = 200
+# numeric (float64) evaluation of matrices:
+NUMERIC_MIN = 1e-300
+NUMERIC_MAX = 1e300
+NUMERIC_ROUNDING = 2**-48 # relative error (float64 epsilon, over a few operations)
+NUMERIC_MAX_ARGUMENT = 2**4 # of exponents and functions, which scale the error of their argument by its size
+BIG_INT_DIGITS = 10 # leading/trailing digits shown of big integers
+BIG_INT_BITS_APPROX = 96
+RENDER_CACHE_SIZE = 256
+RENDER_CACHE_MAX_CHARS = 10**7
+# truncated output:
+OUTPUT_WINDOW_TERMS = 5 # first and last terms of sums
+OUTPUT_ORDER_MAX_TERMS = 1000 # longer sums are truncated in their arguments order (not sorted for printing)
+OUTPUT_CHARS_PER_NODE = 4
 
 def _bin_pad(bin_string, pad_every=4):
         return ' '.join(bin_string[i:i+pad_every] for i in range(0, len(bin_string), pad_every))
@@ -33,10 +62,80 @@ def bin2int(binary_str):
     binary_str = binary_str.replace(' ', '')
     return _twos_complement_to_int(int(binary_str, 2), len(binary_str))
 
+def is_big_int(integer):
+    big_int_bits = IPython.get_ipython().calcpy.big_int_bits
+    return big_int_bits > 0 and int(integer).bit_length() > big_int_bits
+
+def _log10(integer):
+    # of the leading bits only, decimal conversion of big integers is quadratic
+    shift = max(integer.bit_length() - 2*BIG_INT_BITS_APPROX, 0)
+    return mpmath.log10(integer >> shift) + shift * mpmath.log10(2)
+
+def _sci_str(log10):
+    exponent = int(mpmath.floor(log10))
+    mantissa = float(mpmath.power(10, log10 - exponent))
+    # rounding might carry to the exponent
+    mantissa_s, carry = f'{mantissa:.{BIG_INT_DIGITS-1}e}'.split('e')
+    return f'{mantissa_s}e{exponent + int(carry):+}'
+
+def _big_int_digits(integer, log10):
+    # leading digits and number of digits of a positive integer
+    exponent = int(mpmath.floor(log10))
+    scaled = mpmath.power(10, log10 - exponent + BIG_INT_DIGITS - 1)
+    leading = int(mpmath.floor(scaled))
+    if 1e-6 < scaled - leading < 1 - 1e-6:
+        return leading, exponent + 1
+    # close to a digit boundary (e.g. 10**n-1), exact division with a short quotient
+    divisor = 10 ** (exponent - BIG_INT_DIGITS + 1)
+    leading = integer // divisor
+    if leading >= 10**BIG_INT_DIGITS:
+        return leading // 10, exponent + 2
+    if leading < 10**(BIG_INT_DIGITS-1):
+        return integer // (divisor // 10), exponent
+    return leading, exponent + 1
+
+def big_int_str(integer, approx=True):
+    # leading…trailing digits, scientific notation and number of digits, without full decimal conversion
+    integer = int(integer)
+    sign = '-' if integer < 0 else ''
+    integer = abs(integer)
+    if integer < 10**(2*BIG_INT_DIGITS):
+        return sign + str(integer)
+    with mpmath.workprec(integer.bit_length().bit_length() + BIG_INT_BITS_APPROX):
+        log10 = _log10(integer)
+        leading, n_digits = _big_int_digits(integer, log10)
+        sci = _sci_str(log10)
+    trailing = integer % 10**BIG_INT_DIGITS
+    s = f'{sign}{leading}…{trailing:0{BIG_INT_DIGITS}}'
+    if approx:
+        s += f' ≈ {sign}{sci} ({n_digits} digits)'
+    return s
+
+def big_rational_str(rational):
+    p, q = int(rational.p), int(rational.q)
+    with mpmath.workprec(max(p.bit_length(), q.bit_length()).bit_length() + BIG_INT_BITS_APPROX):
+        sci = _sci_str(_log10(abs(p)) - _log10(q))
+    sign = '-' if p < 0 else ''
+    return f'{big_int_str(p, approx=False)}/{big_int_str(q, approx=False)} ≈ {sign}{sci}'
+
+def is_big_number(obj):
+    if isinstance(obj, (int, sympy.Integer)) and not isinstance(obj, bool):
+        return is_big_int(obj)
+    if isinstance(obj, sympy.Rational):
+        return is_big_int(obj.p) or is_big_int(obj.q)
+    return False
+
+def big_number_str(obj):
+    if isinstance(obj, sympy.Rational) and not isinstance(obj, sympy.Integer):
+        return big_rational_str(obj)
+    return big_int_str(obj)
+
 def int_formatter(integer, printer, cycle):
     ip = IPython.get_ipython()
     # avoid formatting inside list etc.:
-    if len(printer.stack) > 1:
+    if is_big_int(integer):
+        printer.text(big_int_str(integer, approx=len(printer.stack) <= 1))
+    elif len(printer.stack) > 1:
         printer.text(repr(integer))
     else:
         if ip.calcpy.bitwidth > 0:
@@ -83,21 +182,63 @@ def integer_to_unicode_power(integer):
         integer //= 10
     return neg + s[::-1]
 
-def ip_sympy_pretty_if_oneline_formatter(obj, printer, cycle):
-    pp = PrettyPrinter()
-    _print_Pow = pp._print_Pow
-    def _print_Pow_unicode(power):
+class MultiLineError(Exception):
+    pass
+
+class OneLinePrettyPrinter(PrettyPrinter):
+    # unicode powers (x⁻¹), stops on the first multi-line sub expression
+    def _print(self, expr, **kwargs):
+        pform = super()._print(expr, **kwargs)
+        if isinstance(pform, stringPict) and pform.height() > 1:
+            raise MultiLineError()
+        return pform
+
+    def _print_Pow(self, power):
         b, e = power.as_base_exp()
         if isinstance(e, sympy.Integer):
-            b = pp._print(b)
+            b = self._print(b)
             if b.height() == 1:
                 if b.binding > prettyForm.MUL and b.binding != prettyForm.NEG:
                     b = stringPict(*b.parens())
                 return prettyForm(*b.right(stringPict(integer_to_unicode_power(e))))
-        return _print_Pow(power)
-    pp._print_Pow = _print_Pow_unicode
+        return super()._print_Pow(power)
+
+# printers are reused, per thread (printing state) and settings
+_one_line_printers = threading.local()
 
-    obj_sympy_pretty = pp.doprint(obj)
+def one_line_printer(use_unicode, num_columns):
+    printers = _one_line_printers.__dict__
+    key = (use_unicode, num_columns)
+    if key not in printers:
+        printers[key] = OneLinePrettyPrinter({'use_unicode': use_unicode, 'num_columns': num_columns})
+    return printers[key]
+
+def is_multi_line(obj):
+    # sub expressions always printed in 2D (fractions, symbolic powers, integrals...), checked before printing
+    if not isinstance(obj, sympy.Basic):
+        return False
+    for node in sympy.preorder_traversal(obj):
+        if isinstance(node, (ExprWithLimits, sympy.Derivative, sympy.exp)):
+            return True
+        if isinstance(node, sympy.Pow) and not node.exp.is_Number:
+            return True
+        if isinstance(node, sympy.Mul):
+            # a single power is printed in one line (x⁻¹), also when negated (in Add)
+            factors = [factor for factor in node.args if factor is not sympy.S.NegativeOne]
+            if any((factor.is_Rational and factor.q != 1) or
+                   (len(factors) > 1 and factor.is_Pow and factor.exp.is_Number and factor.exp.is_negative)
+                   for factor in factors):
+                return True
+    return False
+
+def ip_sympy_pretty_if_oneline_formatter(obj, printer, cycle):
+    pp = one_line_printer(pretty_use_unicode(), shutil.get_terminal_size().columns)
+    try:
+        if is_multi_line(obj):
+            raise MultiLineError()
+        obj_sympy_pretty = pp.doprint(obj)
+    except MultiLineError:
+        obj_sympy_pretty = '\n'
     if '\n' in obj_sympy_pretty:
         printer.text(repr(obj))
     else:
@@ -109,7 +250,86 @@ def ip_matrix_formatter(m, printer, cycle):
 def ip_permutation_formatter(p, printer, cycle):
     printer.text(sympy.printing.pretty(sympy.combinatorics.Cycle(p)))
 
+RenderCacheInfo = collections.namedtuple('RenderCacheInfo', ['hits', 'misses', 'maxsize', 'currsize', 'saved_time', 'render_time'])
+
+def render_settings():
+    ip = IPython.get_ipython()
+    return (ip.display_formatter.formatters['text/plain'].float_format, pretty_use_unicode(), ip.calcpy.big_int_bits,
+            repr(sorted(PrettyPrinter._global_settings.items())))
+
+def render_key(obj):
+    # hashable key of an object by value (and types, 1 and 1.0 are rendered differently), None if unhashable
+    if isinstance(obj, (list, tuple)):
+        keys = tuple(render_key(el) for el in obj)
+        return None if any(key is None for key in keys) else (type(obj), keys)
+    if isinstance(obj, dict):
+        keys = tuple((render_key(key), render_key(value)) for key, value in obj.items())
+        return None if any(key is None or value is None for key, value in keys) else (dict, keys)
+    try:
+        hash(obj)
+    except TypeError:
+        if isinstance(obj, sympy.matrices.MatrixBase): # mutable
+            return (type(obj), obj.shape, tuple(obj))
+        return None
+    return (type(obj), obj)
+
+class RenderCache():
+    # rendered strings by object and terminal size, cleared when printing settings change (e.g. %precision).
+    # saved_time is the rendering time of the hits, render_time of the misses (seconds)
+    def __init__(self, maxsize=RENDER_CACHE_SIZE, max_chars=RENDER_CACHE_MAX_CHARS):
+        self.maxsize = maxsize
+        self.max_chars = max_chars
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict() # key: (string, render time)
+        self.chars = 0
+        self.settings = None
+        self.hits = 0
+        self.misses = 0
+        self.saved_time = 0
+        self.render_time = 0
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.chars = 0
+
+    def render(self, key, func):
+        if key is None:
+            return func()
+        settings = render_settings()
+        with self.lock:
+            if settings != self.settings:
+                self.entries.clear()
+                self.chars = 0
+                self.settings = settings
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.saved_time += entry[1]
+                return entry[0]
+            self.misses += 1
+        t = perf_counter()
+        rendered = func()
+        t = perf_counter() - t
+        with self.lock:
+            self.render_time += t
+            if settings == self.settings and len(rendered) <= self.max_chars:
+                self.entries[key] = (rendered, t)
+                self.chars += len(rendered)
+                while len(self.entries) > self.maxsize or self.chars > self.max_chars:
+                    self.chars -= len(self.entries.popitem(last=False)[1][0])
+        return rendered
+
+    def info(self):
+        return RenderCacheInfo(self.hits, self.misses, self.maxsize, len(self.entries), self.saved_time, self.render_time)
+
+_render_cache = RenderCache()
+
 def pretty_stack(str1, relation, str2, num_columns):
+    return _render_cache.render(('stack', str1, relation, str2, num_columns), lambda: _pretty_stack(str1, relation, str2, num_columns))
+
+def _pretty_stack(str1, relation, str2, num_columns):
     sp1 = stringPict(str1)
     sp1.baseline = sp1.height()//2
     sp2 = stringPict(str2)
@@ -118,51 +338,333 @@ def pretty_stack(str1, relation, str2, num_columns):
     if sp1.width() > .75*num_columns or \
        sp2.width() + len(relation) > .75*num_columns  or \
        sp1.width() + len(relation) + sp2.width() > num_columns:
-        return sp1.render(wrap_line=True, num_columns=num_columns) + f'\n{relation}\n' + \
-               sp2.render(wrap_line=True, num_columns=num_columns)
+        return sp1.render(wrap_line=True, num_columns=num_columns, use_unicode=pretty_use_unicode()) + f'\n{relation}\n' + \
+               sp2.render(wrap_line=True, num_columns=num_columns, use_unicode=pretty_use_unicode())
     else:
         sp2 = stringPict(*sp2.left(relation))
-        return stringPict(*sp1.right(sp2)).render(wrap_line=True, num_columns=num_columns)
+        return stringPict(*sp1.right(sp2)).render(wrap_line=True, num_columns=num_columns, use_unicode=pretty_use_unicode())
 
-def evalf(expr: sympy.Expr):
+def print_above_prompt(text):
+    # from any thread, without messing the line being edited
+    ip = IPython.get_ipython()
+    app = getattr(getattr(ip, 'pt_app', None), 'app', None)
+    if app is None or not app.is_running:
+        print(text)
+        return
+    def print_in_terminal():
+        with set_app(app):
+            run_in_terminal(lambda: print(text))
+    app.loop.call_soon_threadsafe(print_in_terminal)
+
+class ApproxCancelled(BaseException):
+    # raised in a late job by the next cell (not an Exception, the evaluation shouldn't catch it)
+    pass
+
+class ApproxJob(threading.Thread):
+    # evaluation of displayed result, if it takes longer than the budget (late) it is printed when done,
+    # unless the next cell starts first (see cancel)
+    def __init__(self, func, description, print_late):
+        super().__init__(name='approx_job', daemon=True)
+        self.func = func
+        self.description = description
+        self.print_late = print_late
+        self.lock = threading.Lock()
+        self.done = False
+        self.late = False
+        self.cancelled = False
+        self.result = None
+        self.exception = None
+        self.start()
+
+    def run(self):
+        t = perf_counter()
+        try:
+            try:
+                self.result = self.func()
+            except Exception as e:
+                self.exception = e
+            with self.lock:
+                self.done = True
+                late = self.late and not self.cancelled
+            if late:
+                calcpy = IPython.get_ipython().calcpy
+                calcpy._evalf_overruns.append((self.description, perf_counter() - t))
+                if calcpy.debug:
+                    print(f'evalf took {perf_counter() - t:.3f}s: {self.description}')
+                if self.print_late and self.result is not None:
+                    print_above_prompt('\n' + self.result)
+        except ApproxCancelled:
+            pass
+
+    def wait(self, timeout):
+        self.join(timeout)
+        with self.lock:
+            self.late = not self.done
+            return self.done
+
+    def cancel(self):
+        # threads can't be killed, the exception is raised in the job's python code (C code, e.g. a sleep, ends first)
+        with self.lock:
+            if self.done or self.cancelled:
+                return
+            self.cancelled = True
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(self.ident), ctypes.py_object(ApproxCancelled))
+
+def cancel_approx_jobs(info):
+    # late jobs of the previous cell, not to pile up
     calcpy = IPython.get_ipython().calcpy
-    if calcpy.auto_evalf:
-        expr = expr.doit()
+    for job in calcpy._late_approx_jobs:
+        job.cancel()
+    calcpy._late_approx_jobs.clear()
+
+def approx(pretty_s, evalf_func, obj, n_col, n_row, print_late=True):
+    # pretty_s ≈ pretty(evalf_func(obj)), evaluation is limited by calcpy.evalf_budget
+    ip = IPython.get_ipython()
+    calcpy = ip.calcpy
+    def stack(evalu_s):
+        if evalu_s == pretty_s:
+            return pretty_s
+        return pretty_stack(pretty_s, " ≈ ", evalu_s, n_col)
+
+    # not for a command (-c), it would exit before a late result
+    if calcpy.evalf_budget <= 0 or 'InteractiveShellApp.code_to_run' in ip.config:
+        return stack(pretty(evalf_func(obj), n_col, n_row))
+
+    defer = print_late and calcpy.evalf_overrun == 'defer'
+    job = ApproxJob(lambda: stack(pretty(evalf_func(obj), n_col, n_row)), pretty_s[:80], defer)
+    if not job.wait(calcpy.evalf_budget):
+        calcpy._late_approx_jobs.append(job)
+        return stack('…') if defer else pretty_s
+    if job.exception is not None:
+        raise job.exception
+    return job.result
+
+def has_float(expr):
+    return expr.has(sympy.Float)
+
+TRIGSIMP_MAX_MULTIPLE = 1000 # of angles, which trigsimp expands (cos(10**10*x) never ends)
+
+def has_trig(expr):
+    # (and no big multiples of angles)
+    funcs = expr.atoms(sympy.functions.elementary.trigonometric.TrigonometricFunction,
+                       sympy.functions.elementary.hyperbolic.HyperbolicFunction)
+    return bool(funcs) and all(abs(func.args[0].as_coeff_Mul()[0]) <= TRIGSIMP_MAX_MULTIPLE for func in funcs)
+
+# simplification steps: (function, max count_ops to try it or None, applies to expression)
+SIMPLIFY_STEPS = {
+    'nsimplify': (sympy.nsimplify, 100, has_float),
+    'cancel': (sympy.cancel, 1000, None),
+    'together': (sympy.together, 1000, None),
+    'trigsimp': (sympy.trigsimp, 200, has_trig),
+    'simplify': (sympy.simplify, None, None), # (the last resort, as it was before the ladder)
+}
+
+def simplify(expr, ladder=None):
+    # cheap to expensive steps (calcpy.simplify_ladder), each one only up to an expression size (count_ops),
+    # stops at rational functions of symbols (full simplify would hardly do better, but every number is a rational
+    # function). returns also the step that simplified
+    if ladder is None:
+        ladder = IPython.get_ipython().calcpy.simplify_ladder
+    simplified_by = None
+    tried = False
+    ops = sympy.count_ops(expr)
+    for name in ladder:
+        if expr.is_Atom or (tried and expr.free_symbols and expr.is_rational_function()):
+            break
+        func, max_ops, applies = SIMPLIFY_STEPS[name]
+        if (max_ops is not None and ops > max_ops) or (applies is not None and not applies(expr)):
+            continue
+        tried = True
+        simple = func(expr)
+        simple_ops = sympy.count_ops(simple)
+        # simplify has its own measure
+        if simple_ops < ops or (name == 'simplify' and simple != expr):
+            expr, ops, simplified_by = simple, simple_ops, name
+    return expr, simplified_by
+
+def evalf_config(calcpy):
+    return (calcpy.auto_evalf, calcpy.chop, calcpy.auto_expand_factor_poly, tuple(calcpy.simplify_ladder))
+
+def evalf(expr: sympy.Expr):
+    config = evalf_config(IPython.get_ipython().calcpy)
+    try:
+        hash(expr)
+    except TypeError: # mutable matrix
+        return _evalf.__wrapped__(expr, config)
+    return _evalf(expr, config)
+
+# numpy (complex) evaluates the same as sympy, e.g. no branch cuts on the real line
+NUMERIC_FUNCTIONS = (sympy.exp, sympy.log, sympy.sin, sympy.cos, sympy.tan, sympy.sinh, sympy.cosh, sympy.tanh, sympy.Abs, sympy.re, sympy.im)
+# functions losing precision on big arguments (e.g. sin(10**10), exp(40))
+NUMERIC_SCALING_FUNCTIONS = (sympy.exp, sympy.sin, sympy.cos, sympy.tan, sympy.sinh, sympy.cosh)
+
+# lambdify's settings, without ordering terms (slow)
+_numeric_printer = NumPyPrinter({'fully_qualified_modules': False, 'inline': True, 'allow_unknown_functions': True, 'order': 'none'})
+
+def _numeric_template(expr, numbers):
+    # structure of expr, its numbers are collected and replaced by None (exponents are kept, for exact powers)
+    if expr.is_Number:
+        numbers.append(expr)
+        return None
+    if not expr.args:
+        return expr
+    if not isinstance(expr, (sympy.Add, sympy.Mul, sympy.Pow) + NUMERIC_FUNCTIONS): # e.g. integrals, branch cuts
+        raise TypeError(f'{expr.func} is not evaluated numerically')
+    if expr.is_Pow and expr.exp.is_Number:
+        if abs(expr.exp) > NUMERIC_MAX_ARGUMENT:
+            raise TypeError(f'{expr} is not evaluated numerically')
+        return (expr.func, _numeric_template(expr.base, numbers), expr.exp)
+    return (expr.func,) + tuple(_numeric_template(arg, numbers) for arg in expr.args)
+
+def _template_evaluated(template):
+    # as evalf condition - functions, constants or fractions (numbers are checked separately)
+    if not isinstance(template, tuple):
+        return isinstance(template, sympy.NumberSymbol)
+    if issubclass(template[0], sympy.Function):
+        return True
+    if template[0] is sympy.Pow and isinstance(template[2], sympy.Rational):
+        return not template[2].is_Integer or _template_evaluated(template[1])
+    return any(_template_evaluated(arg) for arg in template[1:])
+
+def _complex(number):
+    # exactly, not through evalf
+    if number.is_Rational and abs(number.p) < 2**53 and number.q < 2**53:
+        return complex(number.p / number.q)
+    if number.is_Float and number._prec <= 53:
+        return complex(float(number))
+    raise TypeError(f'{number} is not evaluated numerically')
+
+def _template_expr(template, args):
+    if template is None:
+        return next(args)
+    if not isinstance(template, tuple):
+        return template
+    return template[0](*(_template_expr(arg, args) for arg in template[1:]), evaluate=False)
+
+def _add_operands(expr):
+    # the rounding errors of a sum (cancellation) are relative to its operands
+    return [arg for node in sympy.preorder_traversal(expr) if node.is_Add for arg in node.args]
+
+def _scaling_arguments(expr):
+    return [node.args[0] for node in sympy.preorder_traversal(expr) if isinstance(node, NUMERIC_SCALING_FUNCTIONS)]
+
+def _near_integer(x, tolerance):
+    # maybe exactly (e.g. sin(x)**2 + cos(x)**2 - 1)
+    return abs(x) < 2**52 and abs(x - round(x)) <= tolerance
+
+def evalf_numeric(matrix):
+    # {element: value} of numeric matrix elements, evaluated by numpy - elements of the same structure
+    # (but different numbers) in one call of a lambdified template. elements are left to sympy when
+    # exact (e.g. 1+2i, as evalf does), out of float range, integers (or zero) up to the rounding errors, or
+    # of big arguments (of functions or exponents, over NUMERIC_MAX_ARGUMENT)
+    values = {}
+    groups = collections.defaultdict(list)
+    for el in dict.fromkeys(matrix):
+        if el.is_Integer or el.is_Float:
+            values[el] = el
+        elif el.is_number:
+            numbers = []
+            try:
+                template = _numeric_template(el, numbers)
+                item = (el, numbers, [_complex(number) for number in numbers])
+                groups[template].append(item)
+            except TypeError:
+                pass
+
+    def in_range(x):
+        return x == 0 or NUMERIC_MIN < abs(x) < NUMERIC_MAX
+
+    for template, items in groups.items():
+        if not _template_evaluated(template):
+            items = [item for item in items if any(number.is_Rational and not number.is_Integer for number in item[1])]
+            if not items:
+                continue
+        els, _, numbers = zip(*items)
+        try:
+            args = [sympy.Dummy() for i in range(len(numbers[0]))]
+            expr = _template_expr(template, iter(args))
+            operands = [expr] + _add_operands(expr)
+            func = sympy.lambdify(args, operands + _scaling_arguments(expr), modules='numpy', printer=_numeric_printer)
+            with numpy.errstate(all='ignore'):
+                evaluated = func(*numpy.array(numbers, dtype=complex).reshape(len(els), len(args)).T)
+                evaluated = numpy.array([numpy.broadcast_to(values, len(els)) for values in evaluated], dtype=complex)
+                tolerances = NUMERIC_ROUNDING * abs(evaluated[:len(operands)]).max(axis=0)
+                small_arguments = (abs(evaluated[len(operands):]) <= NUMERIC_MAX_ARGUMENT).all(axis=0)
+        except Exception as e:
+            ip = IPython.get_ipython() # (None in the pool's workers)
+            if ip is not None and ip.calcpy.debug:
+                print(f'numeric evalf failed: {e}')
+            continue
+        for el, result, tolerance, small in zip(els, evaluated[0], tolerances, small_arguments):
+            # (a zero part is exact, of a real or imaginary result)
+            parts = [part for part in (result.real, result.imag) if part != 0] or [0]
+            if small and in_range(result.real) and in_range(result.imag) and \
+               not any(_near_integer(part, tolerance) for part in parts):
+                if result.imag == 0:
+                    values[el] = sympy.Float(float(result.real))
+                else:
+                    values[el] = sympy.Float(float(result.real)) + sympy.Float(float(result.imag))*sympy.I
+    return values
+
+@lru_cache(maxsize=EVALF_CACHE_SIZE)
+def _evalf(expr, config):
+    auto_evalf, chop, auto_expand_factor_poly, ladder = config
+    if auto_evalf:
+        # elements of explicit matrices are evaluated (doit) one by one, numeric elements don't need it
+        if not isinstance(expr, sympy.matrices.MatrixBase) or hasattr(expr, 'as_explicit'):
+            expr = expr.doit()
         if hasattr(expr, 'as_explicit'):
             return expr.as_explicit()
     if isinstance(expr, sympy.matrices.MatrixBase):
-        return expr.applyfunc(evalf)
+        numeric = evalf_numeric(expr) if auto_evalf and not expr.free_symbols else {}
+        return expr.applyfunc(lambda el: numeric[el] if el in numeric else _evalf(el, config))
     elif expr.free_symbols:
-        if expr.is_polynomial() and calcpy.auto_expand_factor_poly:
+        if expr.is_polynomial() and auto_expand_factor_poly:
             expand = expr.expand()
             if expand == expr:
                 factor = expr.factor()
                 if factor == expr:
-                    return expr.simplify()
+                    return simplify(expr, ladder)[0]
                 return factor
             return expand
         elif expr.is_algebraic_expr():
-            return expr.simplify()
+            return simplify(expr, ladder)[0]
         return expr
     else:
-        expr = expr.simplify()
+        expr = simplify(expr, ladder)[0]
     types = set(map(type, expr.atoms(sympy.Rational, sympy.Function, sympy.NumberSymbol, ExprWithLimits)))
     types -= {sympy.Integer, sympy.core.numbers.Zero, sympy.core.numbers.One, sympy.core.numbers.NegativeOne}
     # call evalf only when needed - fractions, functions (e.g. trigonometric), constants (e.g. pi) or limits
-    if calcpy.auto_evalf and types:
-        return expr.evalf(chop=calcpy.chop, n=15)
+    if auto_evalf and types:
+        return expr.evalf(chop=chop, n=15)
     return expr
 
-def evalf_iterable(iterable):
+def evalf_many(exprs, parallel=True):
+    # in the process pool when there are enough expressions or they are big enough,
+    # expressions failed or not done within calcpy.evalf_processes_budget are kept as is
+    calcpy = IPython.get_ipython().calcpy
+    if not parallel or calcpy._pool.processes <= 0 or len(exprs) < 2 or \
+       (len(exprs) < EVALF_PARALLEL_MIN_ITEMS and sum(map(sympy.count_ops, exprs)) < EVALF_PARALLEL_MIN_OPS):
+        return [evalf(expr) for expr in exprs]
+    config = evalf_config(calcpy)
+    budget = calcpy.evalf_processes_budget if calcpy.evalf_processes_budget > 0 else None
+    evalus = []
+    for expr, (success, result) in zip(exprs, calcpy._pool.map(_evalf, [(expr, config) for expr in exprs], budget)):
+        if not success and calcpy.debug:
+            print(f'parallel evalf failed: {result}')
+        evalus.append(result if success else expr)
+    return evalus
+
+def _map_iterable(iterable, func):
     evalu = []
     for idx, el in enumerate(iterable):
         if idx > MAX_SEQ_LENGTH:
             evalu.append('...')
             break
         if isinstance(el, sympy.Expr):
-            evalu.append(evalf(el))
+            evalu.append(func(el))
         elif isinstance(el, (list, tuple)):
-            evalu.append(evalf_iterable(el))
+            evalu.append(_map_iterable(el, func))
         else:
             evalu.append(el)
 
@@ -171,9 +673,19 @@ def evalf_iterable(iterable):
 
     return evalu
 
+def evalf_iterable(iterable, parallel=True):
+    exprs = []
+    _map_iterable(iterable, exprs.append)
+    evalus = iter(evalf_many(exprs, parallel))
+    return _map_iterable(iterable, lambda el: next(evalus))
+
 def pretty(obj, n_col=None, n_row=None):
     if n_col is None or n_row is None:
         n_col, n_row = shutil.get_terminal_size()
+    key = render_key(obj)
+    return _render_cache.render(None if key is None else ('pretty', key, n_col, n_row), lambda: _pretty(obj, n_col, n_row))
+
+def _pretty(obj, n_col, n_row):
     try: # pretty may fail on clashes with other class names
         sympy_pretty = sympy.printing.pretty(obj, num_columns=n_col)
     except:
@@ -195,25 +707,25 @@ def iterable_formatter(iterable, printer, cycle):
     out = pretty_s
 
     try:
-        evalu_s = pretty(evalf_iterable(iterable), n_col, n_row)
-        if evalu_s != pretty_s:
-            out = pretty_stack(out, " ≈ ", evalu_s, n_col)
+        out = approx(pretty_s, evalf_iterable, iterable, n_col, n_row)
     except Exception as e:
         if IPython.get_ipython().calcpy.debug:
             print(f'iterable formatter failed: {e}')
 
     printer.text(out)
 
-def evalf_dict(d):
+def evalf_dict(d, parallel=True):
+    exprs = [el for item in d.items() for el in item if isinstance(el, sympy.Expr)]
+    evalus = dict(zip(exprs, evalf_many(exprs, parallel)))
     evalf_d = {}
     for key in d:
         if isinstance(key, sympy.Expr):
-            evalf_key = evalf(key)
+            evalf_key = evalus[key]
         else:
             evalf_key = key
 
         if isinstance(d[key], sympy.Expr):
-            evalf_d[evalf_key] = evalf(d[key])
+            evalf_d[evalf_key] = evalus[d[key]]
         else:
             evalf_d[evalf_key] = d[key]
 
@@ -226,26 +738,162 @@ def sympy_dict_formatter(d, printer, cycle):
     out = pretty_s
 
     try:
-        evalf_dict_s = pretty(evalf_dict(d), n_col, n_row)
-        if evalf_dict_s != pretty_s:
-            out = pretty_stack(out, " ≈ ", evalf_dict_s, n_col)
+        out = approx(pretty_s, evalf_dict, d, n_col, n_row)
     except Exception as e:
         if IPython.get_ipython().calcpy.debug:
             print(f'dictionary formatter failed: {e}')
 
     printer.text(out)
 
+ELLIPSIS = sympy.Symbol('…')
+
+_show_full = False
+
+def count_nodes(expr, limit):
+    # nodes of the expression tree, counting stops at limit
+    return sum(1 for node in itertools.islice(sympy.preorder_traversal(expr), limit))
+
+def elide(expr, budget):
+    # the expression in about budget tree nodes, subtrees beyond are replaced by …, sums keep their first and last terms
+    if count_nodes(expr, budget + 1) <= budget:
+        return expr
+    if budget < 2:
+        return ELLIPSIS
+    args = expr.args
+    if expr.is_Add and len(args) <= OUTPUT_ORDER_MAX_TERMS:
+        args = expr.as_ordered_terms()
+    if not expr.is_Mul and len(args) > 2*OUTPUT_WINDOW_TERMS + 1: # (factors are reordered by printing)
+        ellipsis = ExprCondPair(ELLIPSIS, ELLIPSIS) if expr.is_Piecewise else ELLIPSIS
+        args = (*args[:OUTPUT_WINDOW_TERMS], ellipsis, *args[-OUTPUT_WINDOW_TERMS:])
+    share = max(1, (budget - 1) // len(args))
+    args = [arg if arg.has(ELLIPSIS) else elide(arg, share) for arg in args]
+    try:
+        try:
+            return expr.func(*args, evaluate=False)
+        except TypeError: # e.g. sums
+            return expr.func(*args)
+    except Exception:
+        return ELLIPSIS
+
+class WindowPrettyPrinter(PrettyPrinter):
+    # terms of sums truncated by elide are in printing order already
+    def _print_Add(self, expr, order=None):
+        if ELLIPSIS in expr.args:
+            order = 'none'
+        return super()._print_Add(expr, order)
+
+def pretty_window(window, n_col, wrap_line=True):
+    printer = WindowPrettyPrinter({'num_columns': n_col, 'wrap_line': wrap_line})
+    # as sympy's pretty does
+    uflag = pretty_use_unicode(printer._settings['use_unicode'])
+    try:
+        return printer.doprint(window)
+    finally:
+        pretty_use_unicode(uflag)
+
+def truncated_output(obj, n_col, n_row):
+    # output of an object too big to render in full, only what fits the terminal is rendered
+    # (and evaluated), so output time is bounded. None if it fits
+    if _show_full or not IPython.get_ipython().calcpy.truncate_output:
+        return None
+    budget = n_col * n_row # each node takes a character at least
+    if isinstance(obj, sympy.matrices.MatrixBase):
+        rows, cols = obj.shape
+        if not rows or not cols:
+            return None
+        # cheap enough to render in full when within the budget, then shown as is if it fits (not wrapped)
+        nodes = 0
+        for el in obj:
+            nodes += count_nodes(el, budget + 1 - nodes)
+            if nodes > budget:
+                break
+        if nodes <= budget:
+            lines = pretty_window(obj, n_col, wrap_line=False).splitlines()
+            if len(lines) <= n_row and max(map(len, lines)) <= n_col:
+                return None
+        def with_ellipsis(m):
+            m = sympy.Matrix(m)
+            if cols > m.cols:
+                m = m.row_join(sympy.Matrix([ELLIPSIS]*m.rows))
+            if rows > m.rows:
+                m = m.col_join(sympy.Matrix([[ELLIPSIS]*m.cols]))
+            return m
+        # top-left corner (half of the terminal, the other half for the evaluated), as many columns as the
+        # widths of their rendered elements allow, then shrunk until it fits
+        max_height = max(1, (n_row - 2) // 2)
+        n_rows = min(rows, max_height)
+        max_cols = min(cols, max(1, n_col // 3)) # (a character and the space between columns at least)
+        el_budget = max(1, budget // (n_rows * max_cols))
+        def el_width(el):
+            return max(map(len, pretty_window(elide(el, el_budget), n_col, wrap_line=False).splitlines()))
+        width = 4 + (3 if max_cols < cols else 0) # brackets, ellipsis column
+        n_cols = 0
+        while n_cols < max_cols:
+            width += max(map(el_width, obj[:n_rows, n_cols])) + 2
+            if width > n_col and n_cols:
+                break
+            n_cols += 1
+        while True:
+            corner = obj[:n_rows, :n_cols]
+            window = corner.applyfunc(lambda el: elide(el, max(1, budget // len(corner))))
+            out = pretty_window(with_ellipsis(window), n_col, wrap_line=False)
+            lines = out.splitlines()
+            height, width = len(lines), max(map(len, lines))
+            if (height <= max_height or n_rows == 1) and (width <= n_col or n_cols == 1):
+                break
+            if height > max_height:
+                n_rows = max(1, min(n_rows - 1, n_rows * max_height // height))
+            if width > n_col:
+                n_cols = max(1, min(n_cols - 1, n_cols * n_col // width))
+        if window == corner:
+            try:
+                out = approx(out, lambda m: with_ellipsis(evalf(m)), corner, n_col, n_row)
+            except Exception as e:
+                if IPython.get_ipython().calcpy.debug:
+                    print(f'truncated output evalf failed: {e}')
+        header = f'Matrix shape={obj.shape}'
+    elif isinstance(obj, sympy.Basic):
+        if count_nodes(obj, budget + 1) <= budget:
+            return None
+        out = pretty_window(elide(obj, budget // OUTPUT_CHARS_PER_NODE), n_col)
+        header = type(obj).__name__
+    else:
+        return None
+    return f'{header} (truncated, show_full() to show all)\n{out}'
+
+def show_full(obj=None):
+    # output of a result truncated by calcpy.truncate_output, the last result by default
+    global _show_full
+    ip = IPython.get_ipython()
+    if obj is None:
+        obj = ip.user_ns.get('_')
+    _show_full = True
+    try:
+        print(ip.display_formatter.formatters['text/plain'](obj))
+    finally:
+        _show_full = False
+
 def sympy_expr_formatter(s, printer, cycle):
     n_col, n_row = shutil.get_terminal_size()
 
+    try:
+        out = truncated_output(s, n_col, n_row)
+    except Exception as e:
+        out = None
+        if IPython.get_ipython().calcpy.debug:
+            print(f'truncated output failed: {e}')
+    if out is not None:
+        printer.text(out)
+        return
+
     pretty_s = pretty(s, n_col, n_row)
     out = pretty_s
 
     try:
-        if not isinstance(s, (sympy.Integer, sympy.Float)):
-            evalu_s = pretty(evalf(s), n_col, n_row)
-            if evalu_s != pretty_s:
-                out = pretty_stack(out, " ≈ ", evalu_s, n_col)
+        if is_big_number(s):
+            out = big_number_str(s)
+        elif not isinstance(s, (sympy.Integer, sympy.Float)):
+            out = approx(pretty_s, evalf, s, n_col, n_row)
     except Exception as e:
         if IPython.get_ipython().calcpy.debug:
             print(f'expr formatter failed: {e}')
@@ -257,11 +905,28 @@ def sympy_pretty_formatter(obj, printer, cycle):
     printer.text(sympy.printing.pretty(obj, num_columns=n_col))
 
 def numpy_array_formatter(obj, printer, cycle):
-    return sympy_expr_formatter(sympy.Matrix(obj), printer, cycle)
+    if obj.dtype == object or obj.size <= IPython.get_ipython().calcpy.numpy_sympy_max_size:
+        return sympy_expr_formatter(sympy.Matrix(obj), printer, cycle)
+
+    n_col, n_row = shutil.get_terminal_size()
+    header = f'ndarray shape={obj.shape} dtype={obj.dtype}'
+    # numpy summarizes each axis to edgeitems from both sides, only these are formatted (by numpy's precision)
+    # rows are not wrapped (only of 1d array)
+    max_line_width = n_col if obj.ndim == 1 else sys.maxsize
+    edgeitems = max(1, (n_row - 4) // 2)
+    while True:
+        array_s = numpy.array2string(obj, max_line_width=max_line_width, threshold=0, edgeitems=edgeitems)
+        lines = array_s.splitlines()
+        if edgeitems == 1 or (len(lines) <= n_row - 3 and max(map(len, lines)) <= n_col):
+            break
+        edgeitems -= 1
+    printer.text(header + '\n' + array_s)
 
 def previewer_formatter(obj):
     try:
-        if isinstance(obj, sympy.Expr):
+        if is_big_number(obj):
+            obj_str = big_number_str(obj)
+        elif isinstance(obj, sympy.Expr):
             obj_str = IPython.lib.pretty.pretty(obj)
             if not isinstance(obj, (sympy.Integer, sympy.Float)):
                 evalu_obj = IPython.lib.pretty.pretty(evalf(obj))
@@ -270,9 +935,9 @@ def previewer_formatter(obj):
         elif isinstance(obj, sympy.combinatorics.Cycle):
             obj_str = IPython.lib.pretty.pretty(obj)
         elif isinstance(obj, (list, tuple)):
-            obj_str = IPython.lib.pretty.pretty(evalf_iterable(obj))
+            obj_str = IPython.lib.pretty.pretty(evalf_iterable(obj, parallel=False))
         elif isinstance(obj, dict):
-            obj_str = IPython.lib.pretty.pretty(evalf_dict(obj))
+            obj_str = IPython.lib.pretty.pretty(evalf_dict(obj, parallel=False))
         else:
             obj_str = IPython.lib.pretty.pretty(obj)
     except:
@@ -285,6 +950,10 @@ def previewer_formatter(obj):
     return obj_str
 
 def init(ip: IPython.InteractiveShell):
+    ip.calcpy._evalf_overruns = collections.deque(maxlen=EVALF_OVERRUNS_LOG_SIZE)
+    ip.calcpy._late_approx_jobs = []
+    ip.events.register('pre_run_cell', cancel_approx_jobs)
+
     sympy.interactive.printing.init_printing(
         pretty_print=True,
         use_latex='mathjax',
@@ -329,6 +998,23 @@ def init(ip: IPython.InteractiveShell):
     PrettyPrinter._print_Float = print_float
     PrettyPrinter._print_float = print_float
 
+    # big integers (also within expressions) by leading and trailing digits
+    print_rational = PrettyPrinter._print_Rational
+    def print_big_rational(self, e):
+        if is_big_int(e.p) or is_big_int(e.q):
+            if e.q == 1:
+                return prettyForm(big_int_str(e.p, approx=False))
+            return prettyForm(big_int_str(e.p, approx=False)) / prettyForm(big_int_str(e.q, approx=False))
+        return print_rational(self, e)
+    def print_int(self, e):
+        # (bool is an int, True/False stay as they are)
+        if isinstance(e, bool) or not is_big_int(e):
+            return self.emptyPrinter(e)
+        return print_big_rational(self, sympy.Integer(e))
+
+    PrettyPrinter._print_Rational = print_big_rational
+    PrettyPrinter._print_int = print_int
+
     # for sympy to support format specifiers:
     def integer__format__(self, format_spec):
         return int.__format__(int(self), format_spec)
@@ -3,163 +3,410 @@ import IPython
 from IPython.core import inputtransformer2
 import shutil
 import sympy
-from contextlib import suppress
-from time import sleep
+import numpy
+import threading
+from time import perf_counter
 import re
 
+from . import formatters
+from . import pool
+from . import infocache
+
+# analyses that take a few steps (run in the info pool, their functions should be picklable):
+def minimum_maximum(expr, sym):
+    return sympy.calculus.util.minimum(expr, sym), sympy.calculus.util.maximum(expr, sym)
+
+def domain_range(expr, sym):
+    return sympy.calculus.util.continuous_domain(expr, sym, sympy.S.Reals), sympy.calculus.util.function_range(expr, sym, sympy.S.Reals)
+
+def inverse(matrix):
+    return matrix**-1
+
+def charpoly(matrix):
+    return matrix.charpoly().as_expr()
+
+def diagonalize_or_jordan(matrix, chop):
+    try:
+        return 'diagonalize', matrix.diagonalize()
+    except sympy.matrices.matrices.MatrixError:
+        return 'jordan_form', matrix.jordan_form(chop=chop)
+
+def normalize(vector):
+    norm = vector.norm()
+    return norm, vector/norm
+
+FACTOR_TRIAL_LIMIT = 2**16
+FACTOR_RHO_STEPS = 2**12 # per attempt
+FACTOR_RHO_ATTEMPTS = 8
+FACTOR_PM1_BOUND = 10**6
+FACTOR_ECM_B1 = 2000 # first, grows 5x after FACTOR_ECM_CURVES curves
+FACTOR_ECM_CURVES = 10
+FACTOR_BUDGET_RATIO = 0.8 # of calcpy.info_timeout, the rest is for returning a partial factorization
+
+def numeric_array(matrix):
+    # of a matrix of numbers (evaluated as by evalf), None if not all are numbers
+    if not all(el.is_number for el in matrix):
+        return None
+    values = formatters.evalf_numeric(matrix)
+    try:
+        array = numpy.array([float(value) if value.is_Float or value.is_Integer else complex(value)
+                             for value in (values.get(el, el) for el in matrix)], dtype=complex).reshape(matrix.shape)
+    except (TypeError, OverflowError):
+        return None
+    if not numpy.isfinite(array).all():
+        return None
+    if not array.imag.any():
+        array = array.real.copy()
+    return array
+
+def integer_facts(n):
+    return n.bit_length(), bin(n).count('1'), sympy.isprime(n)
+
+def factor_attempts(n):
+    # (estimated time relative to the attempt before, attempt), cheap to expensive
+    for seed in range(FACTOR_RHO_ATTEMPTS):
+        yield 1, partial(sympy.ntheory.pollard_rho, n, s=seed+2, retries=0, max_steps=FACTOR_RHO_STEPS)
+    yield 2, partial(sympy.ntheory.pollard_pm1, n, B=FACTOR_PM1_BOUND)
+    # one curve at a time (the public ecm factors completely or fails), private so might go away
+    try:
+        from sympy.ntheory.ecm import _ecm_one_factor
+    except ImportError:
+        return
+    b1 = FACTOR_ECM_B1
+    yield 3, partial(_ecm_one_factor, n, b1, 100*b1, 1, 0)
+    while True:
+        for seed in range(1, FACTOR_ECM_CURVES):
+            yield 1, partial(_ecm_one_factor, n, b1, 100*b1, 1, seed)
+        b1 *= 5
+        yield 5, partial(_ecm_one_factor, n, b1, 100*b1, 1, 0)
+
+def find_factor(n, deadline):
+    # a factor of composite n, or None if not found by the deadline. an attempt is not started if it won't make it
+    attempt_time = 0
+    for relative_time, attempt in factor_attempts(n):
+        if perf_counter() + relative_time*attempt_time >= deadline:
+            return None
+        t = perf_counter()
+        try:
+            factor = attempt()
+        except TypeError: # (e.g. _ecm_one_factor changed)
+            return None
+        if factor is not None:
+            return factor
+        attempt_time = perf_counter() - t
+
+def factor_integer(n, budget=None):
+    # factorint within a time budget (seconds): trial division, pollard rho and p-1, then ecm with growing bounds.
+    # returns (factors, composites) - composites {composite: exponent} are the parts not factored in time
+    if budget is None:
+        return sympy.factorint(n), {}
+    deadline = perf_counter() + budget
+    factors = {}
+    composites = {}
+    def add(m, exp):
+        for base, base_exp in sympy.factorint(m, limit=FACTOR_TRIAL_LIMIT, use_rho=False, use_pm1=False, use_ecm=False).items():
+            found = factors if base < 2 or sympy.isprime(base) else composites
+            found[base] = found.get(base, 0) + exp*base_exp
+    add(n, 1)
+    failed = set()
+    while perf_counter() < deadline:
+        remaining = [composite for composite in composites if composite not in failed]
+        if not remaining:
+            break
+        composite = min(remaining)
+        factor = find_factor(composite, deadline)
+        if factor is None:
+            failed.add(composite)
+            continue
+        exp = composites.pop(composite)
+        add(factor, exp)
+        add(composite // factor, exp)
+    return dict(sorted(factors.items())), composites
+
+INFO_ORDER_WAIT = 1 # seconds a result waits for the analyses before it
+
+class InfoOutput():
+    # shows the results of analyses as they complete, in the order of the analyses. a result waits for the
+    # analyses before it up to INFO_ORDER_WAIT, then those still running are shown as '… = description' (and
+    # their results when done)
+    def __init__(self, analyses, generation):
+        self.analyses = analyses
+        self.generation = generation
+        self.lock = threading.Lock()
+        self.results = {} # idx: (success, result or error)
+        self.waiting = {} # idx: time of result, of results waiting for analyses before them
+        self.next = 0 # analyses before are shown
+        self.running = set() # shown as running
+
+    def cancelled(self):
+        return IPython.get_ipython().calcpy._info_pool.generation != self.generation
+
+    def on_result(self, idx, result):
+        with self.lock:
+            self.results[idx] = result
+            if idx in self.running:
+                self.show(idx)
+                self.running.remove(idx)
+            elif idx > self.next:
+                self.waiting[idx] = perf_counter()
+                timer = threading.Timer(INFO_ORDER_WAIT + 0.01, self.flush_locked)
+                timer.daemon = True
+                timer.start()
+            self.flush()
+
+    def finish(self, results):
+        with self.lock:
+            for idx, result in enumerate(results):
+                if idx not in self.results:
+                    self.results[idx] = result
+                    if idx in self.running:
+                        self.show(idx)
+                        self.running.remove(idx)
+            self.flush()
+
+    def flush_locked(self):
+        with self.lock:
+            self.flush()
+
+    def flush(self):
+        while self.next < len(self.analyses):
+            if self.next in self.results:
+                self.waiting.pop(self.next, None)
+                self.show(self.next)
+            elif self.waiting and min(self.waiting.values()) <= perf_counter() - INFO_ORDER_WAIT and not self.cancelled():
+                self.running.add(self.next)
+                formatters.print_above_prompt(f'\n… = {self.analyses[self.next][0]}')
+            else:
+                break
+            self.next += 1
+
+    def show(self, idx):
+        if self.cancelled():
+            return
+        description, func, args, show = self.analyses[idx]
+        success, result = self.results[idx]
+        try:
+            if success:
+                text = show(result, description)
+            elif idx in self.running or IPython.get_ipython().calcpy.debug:
+                text = f'\n{description} failed: {result}'
+            else:
+                text = None
+        except Exception as e:
+            text = repr(e)
+        if text is not None:
+            formatters.print_above_prompt(text)
+
 def print_info_job(res):
     ip = IPython.get_ipython()
     terminal_size = shutil.get_terminal_size()
     page = terminal_size.columns * terminal_size.lines
     pretty = partial(sympy.printing.pretty, num_columns=terminal_size.columns)
+    generation = ip.calcpy._info_pool.generation # cancelled by the next cell
 
-    sleep(0.05) # so prints won't clash
+    # (description, function, args, show) - function(*args) runs in the info pool (each one limited by
+    # calcpy.info_timeout), show(result, description) is the text to show, None for nothing. results are cached
+    # (persistently) by the description and the args, unless cache_if(result) is false (e.g. partial results)
+    analyses = []
+    cache_ifs = {}
+    def analysis(description, func, *args, cache_if=None):
+        def add(show):
+            if cache_if is not None:
+                cache_ifs[len(analyses)] = cache_if
+            analyses.append((description, func, args, show))
+        return add
 
-    try:
-        res_p = pretty(res)
+    def show_as(unless=None, newline='\n'):
+        def show(result, description):
+            if unless is None or not unless(result):
+                return f'{newline}{pretty(result)} = {description}'
+        return show
+
+    def show_numeric(result, description):
+        if isinstance(result, numpy.generic):
+            return f'\n{pretty(result.item())} = {description}'
+        return f'\n{ip.display_formatter.formatters["text/plain"](result)} = {description}'
+
+    def show_numeric_if_long(result, description):
+        result_print = pretty(result)
+        if len(result_print) > page:
+            result_print = pretty(list(map(sympy.N, result)))
+        return f'\n{result_print} = {description}'
 
+    try:
         if isinstance(res, (float, sympy.Float)):
-            print(f'\n{pretty(sympy.Rational(res))} = Rational(_)')
+            analysis('Rational(_)', sympy.Rational, res)(show_as())
         elif isinstance(res, (complex, sympy.Rational)):
             pass
         elif isinstance(res, (int, sympy.Integer)):
-            factors_dict = sympy.factorint(res)
-            factors_expr = sympy.Mul(*[sympy.Pow(base, expo, evaluate=False) for base, expo in factors_dict.items()], evaluate=False)
-            print(f'\n{pretty(factors_expr)}       {pretty(factors_dict)} = factorint(_)')
+            @analysis('_.bit_length()', integer_facts, int(res))
+            def show_integer_facts(result, description):
+                bit_length, ones, isprime = result
+                # isprime (BPSW) is deterministic below 2**64
+                probable = '  # probable prime' if isprime and abs(res) >= 2**64 else ''
+                return f'\n{bit_length} = _.bit_length()       {ones} = bin(_).count("1")       {isprime} = isprime(_){probable}'
+
+            factor_budget = ip.calcpy.info_timeout * FACTOR_BUDGET_RATIO if ip.calcpy.info_timeout > 0 else None
+            @analysis('factorint(_)', factor_integer, int(res), factor_budget, cache_if=lambda result: not result[1])
+            def show_factorint(result, description):
+                factors_dict, composites = result
+                factors_dict = dict(sorted({**factors_dict, **composites}.items()))
+                # (unevaluated, not passed between processes)
+                factors_expr = sympy.Mul(*[sympy.Pow(base, expo, evaluate=False) for base, expo in factors_dict.items()], evaluate=False)
+                not_factored = f'  # not factored in time: {", ".join(map(str, composites))}' if composites else ''
+                return f'\n{pretty(factors_expr)}       {pretty(factors_dict)} = {description}{not_factored}'
         elif isinstance(res, sympy.Expr):
             # sympy.factor(res, extension=[i]) could be nice (when len(res.free_symbols) >= 1) but not working most of the time
             if len(res.free_symbols) == 1:
                 sym = list(res.free_symbols)[0]
-                print(f'\n{pretty(sympy.diff(res))} = diff(_)')
-                integral = sympy.integrate(res)
-                if not isinstance(integral, sympy.integrals.integrals.Integral):
-                    print(f'\n{pretty(integral)} = integrate(_)')
-                period = sympy.periodicity(res, sym)
-                if period is not None:
-                    print(f'\n{pretty(period)} = periodicity(_, {sym})')
+                analysis('diff(_)', sympy.diff, res)(show_as())
+                analysis('integrate(_)', sympy.integrate, res)(show_as(unless=lambda integral: isinstance(integral, sympy.integrals.integrals.Integral)))
+                analysis(f'periodicity(_, {sym})', sympy.periodicity, res, sym)(show_as(unless=lambda period: period is None))
 
                 # w = sympy.symbols('w')
                 # inverse = sympy.solve(sympy.Eq(res.subs(sym, w), sym),w)
 
             elif len(res.free_symbols) > 1:
                 for sym in res.free_symbols:
-                    print(f'\n{pretty(sympy.diff(res, sym))} = diff(_, {sym})')
+                    analysis(f'diff(_, {sym})', sympy.diff, res, sym)(show_as())
                 for sym in res.free_symbols:
-                    print(f'\n{pretty(sympy.integrate(res, sym))} = integrate(_, {sym})')
+                    analysis(f'integrate(_, {sym})', sympy.integrate, res, sym)(show_as())
                 for sym in res.free_symbols:
-                    period = sympy.periodicity(res, sym)
-                    if period is not None:
-                        print(f'\n{pretty(period)} = periodicity(_, {sym})')
+                    analysis(f'periodicity(_, {sym})', sympy.periodicity, res, sym)(show_as(unless=lambda period: period is None))
 
             if res.is_polynomial():
-                factored = sympy.polys.polytools.factor(res, gaussian=True)
-                if factored != res:
-                    print(f'\n{pretty(factored)} = factor(_, gaussian=True)')
+                analysis('factor(_, gaussian=True)', partial(sympy.polys.polytools.factor, gaussian=True), res)(show_as(unless=lambda factored: factored == res))
             elif len(res.free_symbols) == 1:
-                with suppress(sympy.PoleError):
-                    print(f'\n{pretty(sympy.series(res))} = series(_)')
-
-            # takes forever sometimes
-            # try:
-            #     for sym in res.free_symbols:
-            #         print(f'\n{pretty(sympy.calculus.util.minimum(res, sym))} = calculus.util.minimum(_, {sym})')
-            #         print(f'{pretty(sympy.calculus.util.maximum(res, sym))} = calculus.util.maximum(_, {sym})')
-            # except:
-            #     pass
-
-            # takes forever sometimes
-            # try:
-            #     for sym in res.free_symbols:
-            #         print(f'\n{pretty(sympy.calculus.util.continuous_domain(res, sym, sympy.S.Reals))} = calculus.util.continuous_domain(_, {sym}, S.Reals)')
-            #         print(f'{pretty(sympy.calculus.util.function_range(res, sym, sympy.S.Reals))} = calculus.util.function_range(_, {sym}, S.Reals)')
-            # except:
-            #     pass
+                analysis('series(_)', sympy.series, res)(show_as())
+
+            # these take forever sometimes, limited by the timeout
+            for sym in res.free_symbols:
+                @analysis(f'calculus.util.minimum/maximum(_, {sym})', minimum_maximum, res, sym)
+                def show_minimum_maximum(result, description, sym=sym):
+                    return f'\n{pretty(result[0])} = calculus.util.minimum(_, {sym})\n' \
+                           f'{pretty(result[1])} = calculus.util.maximum(_, {sym})'
+            for sym in res.free_symbols:
+                @analysis(f'calculus.util.continuous_domain/function_range(_, {sym}, S.Reals)', domain_range, res, sym)
+                def show_domain_range(result, description, sym=sym):
+                    return f'\n{pretty(result[0])} = calculus.util.continuous_domain(_, {sym}, S.Reals)\n' \
+                           f'{pretty(result[1])} = calculus.util.function_range(_, {sym}, S.Reals)'
 
             if len(res.free_symbols) > 0:
-                solutions = sympy.solve(res)
-                solutions_print = pretty(solutions)
-                if len(solutions_print) > page:
-                    solutions_print = pretty(list(map(sympy.N, solutions)))
-                print(f'\n{solutions_print} = solve(_)')
-
-            simple = sympy.simplify(res)
-            if simple != res:
-                print(f'\n{pretty(simple)} = simplify(_)')
-
-            with suppress(NotImplementedError):
-                apart = sympy.apart(res)
-                if apart != res:
-                    print(f'\n{pretty(apart)} = apart(_)')
-
-            trigsimp = sympy.trigsimp(res)
-            if trigsimp != res:
-                print(f'\n{pretty(trigsimp)} = trigsimp(_)')
-
-            expand_trig = sympy.expand_trig(res)
-            if expand_trig != res:
-                print(f'\n{pretty(expand_trig)} = expand_trig(_)')
-
-            expand = sympy.expand(res)
-            if expand != res:
-                print(f'\n{pretty(expand)} = expand(_)')
-
-            doit = res.doit()
-            if doit != res:
-                print(f'\n{pretty(doit)} = _.doit()')
-
-            N_p = pretty(sympy.N(res))
-            if N_p != res_p:
-                print(f'\n{N_p} = N(_)')
+                analysis('solve(_)', sympy.solve, res)(show_numeric_if_long)
+
+            @analysis('simplify(_)', formatters.simplify, res, list(ip.calcpy.simplify_ladder))
+            def show_simplify(result, description):
+                simple, simplified_by = result
+                if simple != res:
+                    return f'\n{pretty(simple)} = {simplified_by}(_)'
+
+            analysis('apart(_)', sympy.apart, res)(show_as(unless=lambda apart: apart == res))
+            analysis('trigsimp(_)', sympy.trigsimp, res)(show_as(unless=lambda trigsimp: trigsimp == res))
+            analysis('expand_trig(_)', sympy.expand_trig, res)(show_as(unless=lambda expand_trig: expand_trig == res))
+            analysis('expand(_)', sympy.expand, res)(show_as(unless=lambda expand: expand == res))
+            analysis('_.doit()', type(res).doit, res)(show_as(unless=lambda doit: doit == res))
+
+            @analysis('N(_)', sympy.N, res)
+            def show_N(result, description):
+                N_p = pretty(result)
+                if N_p != pretty(res):
+                    return f'\n{N_p} = {description}'
         elif isinstance(res, sympy.matrices.MatrixBase):
-            if res.rows == res.cols:
-                print(f'\n{pretty(sympy.det(res))} = det(_)')
-                print(f'{pretty(sympy.trace(res))} = trace(_)')
-                try:
-                    print(f'\n{pretty(res**-1)} = _**-1')
-                except:
-                    pass
-                print(f'\n{pretty(res.charpoly().as_expr())} = _.charpoly().as_expr()')
-                evs = res.eigenvects()
-                evs_print = pretty(evs)
-                if len(evs_print) > page:
-                    evs = [(sympy.N(ev[0]), ev[1], tuple(map(sympy.N, ev[2]))) for ev in evs]
-                    evs_print = pretty(evs)
-                print(f'\n{evs_print} = _.eigenvects() # ((eval, mult, evec),...')
-                try:
-                    diag = res.diagonalize()
-                    diag_print = pretty(diag)
-                    if len(diag_print) > page:
-                        diag_print = pretty(list(map(sympy.N, diag)))
-                    print(f'\n{diag_print} = _.diagonalize() # (P,D) so _=PDP^-1')
-                except sympy.matrices.matrices.MatrixError:
-                    jord = res.jordan_form(chop=ip.calcpy.chop)
-                    jord_print = pretty(jord)
-                    if len(jord_print) > page:
-                        jord_print = pretty(list(map(sympy.N, jord)))
-                    print(f'\n{jord_print} = _.jordan_form() # (P,J) so _=PJP^-1')
-
-            elif res.rows > 1 and res.cols > 1:
-                print(f'\n{pretty(res.rank())} = _.rank()')
-                print(f'\n{pretty(res.pinv())} = _.pinv()')
-            else: # vector
-                norm = res.norm()
-                print(f'\n{pretty(norm)} = _.norm()')
-                print(f'\n{pretty(res/norm)} = _/_.norm()')
+            # matrices of numbers larger than calcpy.info_numeric_matrix_size are analyzed numerically (by numpy),
+            # exact rational ones also symbolically
+            array = None
+            if min(res.shape) > 1 and max(res.shape) > ip.calcpy.info_numeric_matrix_size:
+                array = numeric_array(res)
+            if array is not None:
+                if res.rows == res.cols:
+                    analysis('np.linalg.det(_)', numpy.linalg.det, array)(show_numeric)
+                    analysis('np.linalg.inv(_)', numpy.linalg.inv, array)(show_numeric)
+
+                    @analysis('np.linalg.eig(_)', numpy.linalg.eig, array)
+                    def show_eig(result, description):
+                        eigenvalues, eigenvectors = result
+                        return f'{show_numeric(eigenvalues, description + "[0]")}\n{show_numeric(eigenvectors, description + "[1]")}'
+                else:
+                    analysis('np.linalg.pinv(_)', numpy.linalg.pinv, array)(show_numeric)
+                analysis('np.linalg.svd(_, compute_uv=False)', partial(numpy.linalg.svd, compute_uv=False), array)(show_numeric)
+                analysis('np.linalg.cond(_)', numpy.linalg.cond, array)(show_numeric)
+                analysis('np.linalg.matrix_rank(_)', numpy.linalg.matrix_rank, array)(show_numeric)
+
+            if array is None or all(el.is_Rational for el in res):
+                if res.rows == res.cols:
+                    analysis('det(_)', sympy.det, res)(show_as())
+                    analysis('trace(_)', sympy.trace, res)(show_as(newline=''))
+                    analysis('_**-1', inverse, res)(show_as())
+                    analysis('_.charpoly().as_expr()', charpoly, res)(show_as())
+
+                    @analysis('_.eigenvects() # ((eval, mult, evec),...', type(res).eigenvects, res)
+                    def show_eigenvects(evs, description):
+                        evs_print = pretty(evs)
+                        if len(evs_print) > page:
+                            evs = [(sympy.N(ev[0]), ev[1], tuple(map(sympy.N, ev[2]))) for ev in evs]
+                            evs_print = pretty(evs)
+                        return f'\n{evs_print} = {description}'
+
+                    @analysis('_.diagonalize()', diagonalize_or_jordan, res, ip.calcpy.chop)
+                    def show_diagonalize_or_jordan(result, description):
+                        name, decomposition = result
+                        decomposition_print = pretty(decomposition)
+                        if len(decomposition_print) > page:
+                            decomposition_print = pretty(list(map(sympy.N, decomposition)))
+                        if name == 'diagonalize':
+                            return f'\n{decomposition_print} = _.diagonalize() # (P,D) so _=PDP^-1'
+                        return f'\n{decomposition_print} = _.jordan_form() # (P,J) so _=PJP^-1'
+
+                elif res.rows > 1 and res.cols > 1:
+                    analysis('_.rank()', type(res).rank, res)(show_as())
+                    analysis('_.pinv()', type(res).pinv, res)(show_as())
+                else: # vector
+                    @analysis('_.norm()', normalize, res)
+                    def show_normalize(result, description):
+                        return f'\n{pretty(result[0])} = _.norm()\n\n{pretty(result[1])} = _/_.norm()'
         elif isinstance(res, (list, tuple)):
             pass
         elif res is not None:
             try:
-                res = sympy.sympify(res)
-                print_info_job(res)
+                sympified = sympy.sympify(res)
+                if isinstance(sympified, sympy.NDimArray) and sympified.rank() == 2: # e.g. of numpy
+                    sympified = sympified.tomatrix()
+                if type(sympified) is not type(res):
+                    print_info_job(sympified)
             except sympy.SympifyError:
                 pass
 
+        output = InfoOutput(analyses, generation)
+        keys = [infocache.info_key(description, args) for description, func, args, show in analyses]
+        cached = ip.calcpy._info_cache.get(keys)
+        for idx, result in cached.items():
+            output.on_result(idx, result)
+        missing = [idx for idx in range(len(analyses)) if idx not in cached]
+        def on_result(missing_idx, result):
+            idx = missing[missing_idx]
+            output.on_result(idx, result)
+            success, value = result
+            if not success or idx not in cache_ifs or cache_ifs[idx](value):
+                ip.calcpy._info_cache.put(keys[idx], result)
+
+        results = [cached.get(idx) for idx in range(len(analyses))]
+        if missing:
+            info_timeout = ip.calcpy.info_timeout if ip.calcpy.info_timeout > 0 else None
+            # not for a command (-c), its workers would be started to be used once
+            interactive = 'InteractiveShellApp.code_to_run' not in ip.config
+            ip.calcpy._info_pool.resize(ip.calcpy.info_processes if interactive else 0)
+            missing_results = ip.calcpy._info_pool.run([analyses[idx][1:3] for idx in missing],
+                                                       task_timeout=info_timeout, generation=generation, on_result=on_result)
+            for idx, result in zip(missing, missing_results):
+                results[idx] = result
+        output.finish(results)
+
     except Exception as e:
         print(repr(e))
 
 def print_info(res):
-    ip = IPython.get_ipython()
-    ip.calcpy.jobs.new(print_info_job, res, daemon=True)
+    # analyzed after the cell (so after its output)
+    IPython.get_ipython().calcpy._info_res = res
 
 def init(ip:IPython.InteractiveShell):
     inputtransformer2._help_end_re = re.compile(r"""([^?]*)()(\?\??)$""")
@@ -177,3 +424,16 @@ else:
 '''
 
     inputtransformer2._make_help_call = calcpy_info_make_help_call
+
+    ip.calcpy._info_pool = pool.Pool() # started by the first '?'
+    ip.calcpy._info_res = None
+    ip.calcpy._info_job = None
+    def cancel_info(info):
+        ip.calcpy._info_pool.cancel()
+        ip.calcpy._info_res = None
+    ip.events.register('pre_run_cell', cancel_info)
+    def start_info(result):
+        if ip.calcpy._info_res is not None:
+            ip.calcpy._info_job = ip.calcpy.jobs.new(print_info_job, ip.calcpy._info_res, daemon=True)
+            ip.calcpy._info_res = None
+    ip.events.register('post_run_cell', start_info)
@@ -0,0 +1,129 @@
+import os
+import pickle
+import sqlite3
+import hashlib
+import threading
+import collections
+from time import time
+import IPython
+import sympy
+import numpy
+
+from . import __version__
+
+INFO_CACHE_FILE_NAME = 'info_cache.sqlite'
+
+# not cached, might go differently next time:
+TRANSIENT_ERRORS = ('timeout', 'cancelled', 'worker died')
+
+InfoCacheInfo = collections.namedtuple('InfoCacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+def canonical(arg):
+    if isinstance(arg, numpy.ndarray): # (repr is summarized)
+        return f'ndarray({arg.dtype}, {arg.shape}, {hashlib.sha256(arg.tobytes()).hexdigest()})'
+    return sympy.srepr(arg)
+
+def info_key(description, args):
+    # content addressed, by the canonical form of the arguments (also the assumptions on symbols)
+    key = '\n'.join((sympy.__version__, __version__, description, *map(canonical, args)))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+class InfoCache():
+    # persistent results of the analyses of '?', in a single file. least recently used are evicted over the size
+    # limit (bytes). opened on first use
+    def __init__(self, path, maxsize):
+        self.path = path
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.db = None
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            self.db.execute('CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value BLOB, size INTEGER, used REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS info_used ON info (used)')
+        return self.db
+
+    def get(self, keys):
+        # {index: (success, result or error)} of the keys found
+        found = {}
+        if self.maxsize <= 0:
+            return found
+        with self.lock:
+            try:
+                db = self.connect()
+                for idx, key in enumerate(keys):
+                    row = db.execute('SELECT value FROM info WHERE key = ?', (key,)).fetchone()
+                    if row is None:
+                        self.misses += 1
+                        continue
+                    try:
+                        found[idx] = pickle.loads(row[0])
+                    except Exception: # e.g. of a module that changed
+                        db.execute('DELETE FROM info WHERE key = ?', (key,))
+                        self.misses += 1
+                        continue
+                    db.execute('UPDATE info SET used = ? WHERE key = ?', (time(), key))
+                    self.hits += 1
+            except sqlite3.Error as e:
+                self.error(e)
+        return found
+
+    def put(self, key, result):
+        success, value = result
+        if self.maxsize <= 0 or (not success and value in TRANSIENT_ERRORS):
+            return
+        try:
+            data = pickle.dumps(result)
+        except Exception:
+            return
+        if len(data) > self.maxsize:
+            return
+        with self.lock:
+            try:
+                db = self.connect()
+                db.execute('INSERT OR REPLACE INTO info VALUES (?, ?, ?, ?)', (key, data, len(data), time()))
+                self.evict(db)
+            except sqlite3.Error as e:
+                self.error(e)
+
+    def evict(self, db):
+        size = db.execute('SELECT TOTAL(size) FROM info').fetchone()[0]
+        if size <= self.maxsize:
+            return
+        for key, entry_size in db.execute('SELECT key, size FROM info ORDER BY used').fetchall():
+            if size <= self.maxsize:
+                break
+            db.execute('DELETE FROM info WHERE key = ?', (key,))
+            size -= entry_size
+
+    def error(self, e):
+        if IPython.get_ipython().calcpy.debug:
+            print(f'info cache {self.path}: {repr(e)}')
+
+    def clear(self):
+        with self.lock:
+            try:
+                self.connect().execute('DELETE FROM info')
+            except sqlite3.Error as e:
+                self.error(e)
+
+    def info(self):
+        with self.lock:
+            try:
+                currsize = int(self.connect().execute('SELECT TOTAL(size) FROM info').fetchone()[0])
+            except sqlite3.Error:
+                currsize = 0
+        return InfoCacheInfo(self.hits, self.misses, self.maxsize, currsize)
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+def init(ip: IPython.InteractiveShell):
+    path = os.path.join(ip.profile_dir.location, INFO_CACHE_FILE_NAME)
+    ip.calcpy._info_cache = InfoCache(path, int(ip.calcpy.info_cache_size * 2**20))
@@ -0,0 +1,192 @@
+import signal
+import threading
+import collections
+import multiprocessing as mp
+import multiprocessing.connection
+from time import perf_counter
+import IPython
+
+def worker_main(conn):
+    # ctrl+c of the terminal propagates to subprocesses
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from . import info # (heavy imports of the analyses, before the first task)
+    conn.send(None) # ready
+    while True:
+        try:
+            func, args = conn.recv()
+        except (EOFError, OSError):
+            return # pipe closed
+        try:
+            result = (True, func(*args))
+        except Exception as e:
+            result = (False, repr(e))
+        try:
+            conn.send(result)
+        except Exception as e: # unpicklable result
+            conn.send((False, repr(e)))
+
+# workers are not forked from the shell, a fork while another thread imports a module would deadlock on
+# the import lock. spawned by their own context, leaving the default (and the fork server) of the user as is
+_context = mp.get_context('spawn')
+
+class Worker():
+    def __init__(self):
+        self.conn, worker_conn = _context.Pipe()
+        self.process = _context.Process(target=worker_main, args=(worker_conn,), name='calcpy_worker', daemon=True)
+        self.process.start()
+        worker_conn.close()
+        self.ready = False # its first message, after the imports
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def kill(self):
+        self.process.kill()
+        self.conn.close()
+
+class Pool():
+    # worker processes, kept warm between cells. a task running over time is cancelled by killing its worker
+    def __init__(self, processes=0):
+        self.lock = threading.Lock()
+        self.workers = []
+        # cancel() from any thread wakes up run(), cancel_lock keeps it from leaving a message after run()
+        self.cancel_conn, self.cancel_send_conn = mp.Pipe(duplex=False)
+        self.cancel_lock = threading.Lock()
+        self.generation = 0 # of cancel()
+        self.running = False
+        self.resize(processes)
+
+    def resize(self, processes):
+        # workers are started by the next run (they take a while to start, and might not be needed)
+        with self.lock:
+            self.processes = processes
+            while len(self.workers) > processes:
+                self.workers.pop().kill()
+
+    def _start(self):
+        processes = self.processes
+        if mp.current_process().daemon: # e.g. in the previewer, can't have subprocesses
+            processes = 0
+        for worker in [worker for worker in self.workers if not worker.alive()]:
+            worker.kill()
+            self.workers.remove(worker)
+        while len(self.workers) > processes:
+            self.workers.pop().kill()
+        while len(self.workers) < processes:
+            self.workers.append(Worker())
+
+    def replace(self, worker):
+        worker.kill()
+        new_worker = Worker()
+        self.workers[self.workers.index(worker)] = new_worker
+        return new_worker
+
+    def map(self, func, args_list, timeout=None):
+        # [(success, result or error), ...] in order, tasks not done by the timeout fail with 'timeout'
+        return self.run([(func, args) for args in args_list], timeout)
+
+    def run(self, tasks, timeout=None, task_timeout=None, generation=None, on_result=None):
+        # [(success, result or error), ...] of [(func, args), ...] in order. tasks not done by the timeout,
+        # or running longer than task_timeout, fail with 'timeout', tasks not done on cancel() with 'cancelled'
+        # (also of a cancel() since the generation). without workers tasks run here (no timeouts).
+        # on_result(index, (success, result or error)) is called as each task is done
+        deadline = None if timeout is None else perf_counter() + timeout
+        with self.lock:
+            with self.cancel_lock:
+                if generation is not None and generation != self.generation:
+                    return [(False, 'cancelled')] * len(tasks)
+                self.running = True
+            try:
+                return self._run(tasks, deadline, task_timeout, on_result)
+            finally:
+                with self.cancel_lock:
+                    self.running = False
+                    while self.cancel_conn.poll():
+                        self.cancel_conn.recv()
+
+    def _run(self, tasks, deadline, task_timeout, on_result):
+        results = [(False, 'timeout')] * len(tasks)
+        self._start() # (also replaces dead workers)
+        if not self.workers:
+            for idx, (func, args) in enumerate(tasks):
+                if self.cancel_conn.poll():
+                    results[idx:] = [(False, 'cancelled')] * (len(tasks) - idx)
+                    break
+                try:
+                    results[idx] = (True, func(*args))
+                except Exception as e:
+                    results[idx] = (False, repr(e))
+                if on_result is not None:
+                    on_result(idx, results[idx])
+            return results
+        pending = collections.deque(enumerate(tasks))
+        idle = list(self.workers)
+        busy = {} # conn: (worker, idx, start time)
+        while pending or busy:
+            while pending and idle:
+                idx, task = pending.popleft()
+                worker = idle.pop()
+                try:
+                    worker.conn.send(task)
+                except Exception as e: # unpicklable arguments
+                    results[idx] = (False, repr(e))
+                    idle.append(worker)
+                    if on_result is not None:
+                        on_result(idx, results[idx])
+                    continue
+                # (task time starts when the worker is ready)
+                busy[worker.conn] = (worker, idx, perf_counter() if worker.ready else None)
+            if not busy:
+                continue
+            deadlines = [] if deadline is None else [deadline]
+            if task_timeout is not None:
+                deadlines += [start + task_timeout for worker, idx, start in busy.values() if start is not None]
+            remaining = None if not deadlines else max(min(deadlines) - perf_counter(), 0)
+            ready = mp.connection.wait(list(busy) + [self.cancel_conn], remaining)
+            if self.cancel_conn in ready:
+                self.cancel_conn.recv()
+                for idx, task in pending:
+                    results[idx] = (False, 'cancelled')
+                for worker, idx, start in busy.values():
+                    results[idx] = (False, 'cancelled')
+                break
+            for conn in ready:
+                worker, idx, start = busy.pop(conn)
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    results[idx] = (False, 'worker died')
+                    idle.append(self.replace(worker))
+                else:
+                    if not worker.ready:
+                        worker.ready = True
+                        busy[conn] = (worker, idx, perf_counter())
+                        continue
+                    results[idx] = message
+                    idle.append(worker)
+                if on_result is not None:
+                    on_result(idx, results[idx])
+            if deadline is not None and perf_counter() >= deadline:
+                break
+            if task_timeout is not None:
+                for conn, (worker, idx, start) in list(busy.items()):
+                    if start is not None and perf_counter() - start >= task_timeout:
+                        del busy[conn] # results[idx] is 'timeout'
+                        idle.append(self.replace(worker))
+                        if on_result is not None:
+                            on_result(idx, results[idx])
+        for worker, idx, start in busy.values():
+            self.replace(worker)
+        return results
+
+    def cancel(self):
+        with self.cancel_lock:
+            self.generation += 1
+            if self.running:
+                self.cancel_send_conn.send(None)
+
+    def close(self):
+        self.resize(0)
+
+def init(ip: IPython.InteractiveShell):
+    ip.calcpy._pool = Pool(ip.calcpy.evalf_processes)
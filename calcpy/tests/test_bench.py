@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+
+from calcpy import bench
+
+def test_bench(ip):
+    report = bench.run(ip, n=1)
+    print(bench.summary(report))
@@ -1,7 +1,8 @@
 from sympy.abc import x, y
 from sympy import I as i
-from sympy import Rational, Matrix
+from sympy import Rational, Matrix, symbols
 from IPython.lib.pretty import pretty
+from time import sleep
 from calcpy.formatters import evalf
 
 def test_unicode_power(ip):
@@ -19,3 +20,173 @@ def test_evalf(ip):
     assert evalf(Rational(1,2)) == 0.5
     assert evalf(Matrix(((x**2+2*x+1, Rational(1,2)),))) == Matrix((((x+1)**2, 0.5),))
 
+def test_evalf_cache(ip):
+    evalf(x**2+2*x+1)
+    hits = ip.calcpy.cache_info()['evalf'].hits
+    assert evalf(x**2+2*x+1) == (x+1)**2
+    assert ip.calcpy.cache_info()['evalf'].hits == hits + 1
+    ip.calcpy.auto_expand_factor_poly = False
+    assert evalf(x**2+2*x+1) == x**2+2*x+1
+    # assumptions changed:
+    expr = ip.run_cell('sqrt(w**2)').result
+    assert evalf(expr) == expr
+    ip.run_cell('symbols("w", positive=True)')
+    assert evalf(expr) == symbols('w')
+    ip.run_cell('del w')
+
+def test_evalf_budget(ip, capsys):
+    from calcpy.formatters import approx
+    def slow_evalf(obj):
+        sleep(0.2)
+        return obj + 1
+    overruns = len(ip.calcpy._evalf_overruns)
+    ip.calcpy.evalf_budget = 0.05
+    ip.calcpy.evalf_overrun = 'skip'
+    assert approx('x', slow_evalf, x, 80, 24) == 'x'
+    ip.calcpy.evalf_overrun = 'defer'
+    assert approx('x', slow_evalf, x, 80, 24) == 'x ≈ …'
+    sleep(0.5)
+    assert capsys.readouterr().out == '\nx ≈ x + 1\n'
+    assert len(ip.calcpy._evalf_overruns) == overruns + 2
+    # late jobs are stopped by the next cell:
+    def slower_evalf(obj):
+        for _ in range(500):
+            sleep(0.01)
+        return obj + 1
+    assert approx('x', slower_evalf, x, 80, 24) == 'x ≈ …'
+    job = ip.calcpy._late_approx_jobs[-1]
+    ip.run_cell('pass')
+    job.join(1)
+    assert not job.is_alive()
+    assert capsys.readouterr().out == ''
+    # no budget for a command (-c), it wouldn't wait for late results:
+    ip.config.InteractiveShellApp.code_to_run = 'x'
+    assert approx('x', slow_evalf, x, 80, 24) == 'x ≈ x + 1'
+    del ip.config.InteractiveShellApp['code_to_run']
+    ip.calcpy.evalf_budget = 1
+    assert approx('x', slow_evalf, x, 80, 24) == 'x ≈ x + 1'
+
+def test_simplify_ladder(ip):
+    from sympy import sin, cos, pi, gamma, Mul
+    from calcpy.formatters import simplify
+    assert simplify((x**2-1)/(x-1)) == (x+1, 'cancel')
+    assert simplify(sin(x)**2+cos(x)**2) == (1, 'trigsimp')
+    assert simplify(x/2+y/3) == (x/2+y/3, None)
+    assert simplify(cos(1)**2+sin(1)**2) == (1, 'trigsimp')
+    # big ones too:
+    zs = symbols('z:110')
+    assert simplify(gamma(x+1)/gamma(x)*Mul(*[z**2 for z in zs])) == (x*Mul(*[z**2 for z in zs]), 'simplify')
+    assert evalf(sin(pi/7)**2+cos(pi/7)**2) == 1
+    ip.calcpy.simplify_ladder = ['simplify']
+    assert simplify((x**2-1)/(x-1)) == (x+1, 'simplify')
+    assert evalf((x**2-1)/(x-1)) == x+1
+    ip.calcpy.simplify_ladder = ['cancel', 'together', 'trigsimp', 'simplify']
+
+def test_numpy_array_formatter(ip):
+    import shutil
+    import numpy as np
+    n_col, n_row = shutil.get_terminal_size()
+    formatter = ip.display_formatter.formatters['text/plain']
+    out = formatter(np.zeros((1000, 1000)))
+    assert out.startswith('ndarray shape=(1000, 1000) dtype=float64\n[[0. 0.')
+    assert len(out.splitlines()) <= n_row
+    assert max(map(len, out.splitlines())) <= n_col
+    assert formatter(np.array([[1, 2]])) == formatter(Matrix([[1, 2]]))
+    ip.calcpy.numpy_sympy_max_size = 1
+    assert formatter(np.array([[1, 2]])).startswith('ndarray shape=(1, 2) dtype=int64\n[[1 2]]')
+
+def test_big_int(ip):
+    from calcpy.formatters import big_int_str, big_number_str
+    assert big_int_str(2**20000) == '3980276840…3406309376 ≈ 3.980276840e+6020 (6021 digits)'
+    assert big_int_str(-10**5000+1, approx=False) == '-9999999999…9999999999'
+    assert big_int_str(10**5000) == '1000000000…0000000000 ≈ 1.000000000e+5000 (5001 digits)'
+    assert big_number_str(Rational(1, 3**10000)) == '1/1631350185…6552200001 ≈ 6.129891724e-4772'
+    formatter = ip.display_formatter.formatters['text/plain']
+    assert formatter(ip.run_cell('5000!').result) == '4228577926…0000000000 ≈ 4.228577927e+16325 (16326 digits)'
+    assert formatter([2**20000, 1]) == '[3980276840…3406309376, 1]'
+    assert pretty(2**20000*x) in ('3980276840…3406309376⋅x', '3980276840…3406309376*x')
+    assert formatter([True, 1]) == '[True, 1]'
+    assert formatter((1 < 2, 3 > 4)) == '(True, False)'
+    assert formatter({x: True}) == '{x: True}'
+    ip.calcpy.big_int_bits = 0
+    assert pretty(2**1000) == str(2**1000)
+
+def test_one_line_formatter(ip):
+    import IPython.lib.pretty
+    from sympy import Integral, sqrt, exp
+    from calcpy.formatters import one_line_printer, is_multi_line
+    assert IPython.lib.pretty.pretty([x**-1, x**2*y, sqrt(x), (x+y)**-2, 1-1/x**2, Rational(1,2)]) == '[x⁻¹, x²⋅y, √x, (x + y)⁻², 1 - x⁻², 1/2]'
+    assert IPython.lib.pretty.pretty([x/2, x**y, Integral(x, x), exp(x)]) == '[x/2, x**y, Integral(x, x), exp(x)]'
+    assert one_line_printer(True, 80) is one_line_printer(True, 80)
+    assert not is_multi_line(1-1/x**2)
+    assert is_multi_line(x/y)
+
+def test_parallel_evalf(ip):
+    from sympy import pi, sqrt
+    from calcpy.formatters import evalf_iterable, evalf_dict
+    exprs = [sqrt(k)*pi + x for k in range(20)]
+    serial = evalf_iterable([exprs, tuple(exprs[:3])])
+    ip.calcpy.evalf_processes = 2
+    assert len(ip.calcpy._pool.workers) == 0 # started on first use
+    assert evalf_iterable([exprs, tuple(exprs[:3])]) == serial
+    assert len(ip.calcpy._pool.workers) == 2
+    assert evalf_dict({pi*k: sqrt(k) for k in range(20)}) == {evalf(pi*k): evalf(sqrt(k)) for k in range(20)}
+    ip.calcpy.evalf_processes = 0
+    assert len(ip.calcpy._pool.workers) == 0
+
+def test_numeric_matrix_evalf(ip):
+    from sympy import pi, E, sqrt, sin, cos, tan, exp, atanh, Integral, Float
+    from calcpy.formatters import evalf_numeric
+    m = Matrix(6, 6, lambda r, c: sqrt(r+c) + Rational(r, c+1) + sin(pi/(c+1))*i)
+    numeric = evalf(m)
+    for el, expected in zip(numeric, m.applyfunc(lambda el: el.evalf())):
+        assert abs(complex(el) - complex(expected)) < 1e-12
+    m = Matrix([[1, 1+2*i, Rational(1, 3)], [Integral(x, (x, 0, 1)), atanh(sqrt(3)), Float(0.5)]])
+    numeric = evalf_numeric(m)
+    assert set(numeric) == {1, Rational(1, 3), Float(0.5)}
+    assert evalf(m) == Matrix([[1, 1+2*i, 1/Float(3)], [0.5, atanh(sqrt(3)).evalf(), 0.5]])
+    # cancelling to (nearly) zero or an integer, exactly by sympy:
+    assert evalf(Matrix([[cos(1)**2+sin(1)**2-1, 1], [pi, sqrt(2)]])) == Matrix([[0, 1], [pi.evalf(), sqrt(2).evalf()]])
+    assert evalf(Matrix([[sin(pi/7)**2+cos(pi/7)**2, sqrt(2)]]))[0] == 1
+    # big arguments lose precision, by sympy too:
+    for el in (cos(10**10*sqrt(3)), tan(33*10**17*E), exp(pi*sqrt(163)), (1+sqrt(2))**30):
+        assert evalf(Matrix([[el, 1], [1, 1]]))[0] == el.evalf(15)
+
+def test_render_cache(ip):
+    from calcpy.formatters import render_key
+    formatter = ip.display_formatter.formatters['text/plain']
+    expr = x/3 + Rational(1, 2)
+    out = formatter(expr)
+    hits = ip.calcpy.cache_info()['render'].hits
+    assert formatter(expr) == out
+    assert ip.calcpy.cache_info()['render'].hits >= hits + 2 # expression, evaluated and stacked
+    assert formatter([1, 2.5]) != formatter([1.0, 2.5])
+    assert render_key(Matrix([[1, 2]])) == render_key(Matrix([[1, 2]]))
+    assert render_key([1, {2}]) is None
+    # precision changed:
+    assert formatter(Rational(1, 3)*1.0) == '0.333333333333333'
+    ip.run_line_magic('precision', '2')
+    assert formatter(Rational(1, 3)*1.0) == '0.33'
+    ip.run_line_magic('precision', '')
+
+def test_truncated_output(ip, capsys):
+    from sympy import Add, Piecewise
+    from calcpy.formatters import show_full
+    formatter = ip.display_formatter.formatters['text/plain']
+    m = Matrix(30, 30, lambda r, c: r*c)
+    out = formatter(m)
+    assert out.startswith('Matrix shape=(30, 30) (truncated, show_full() to show all)\n')
+    assert len(out.splitlines()) < 24 and '…' in out
+    assert 'truncated' not in formatter(Matrix(3, 3, lambda r, c: r*x + c))
+    # small enough for the terminal, though wide or long:
+    for small in (Matrix([list(range(12))]), Matrix(12, 2, lambda r, c: r + c), Matrix(12, 12, lambda r, c: r*c)):
+        assert 'truncated' not in formatter(small)
+    out = formatter(Add(*[x**k for k in range(1000)]))
+    assert out.startswith('Add (truncated')
+    assert len(out) < 2000
+    assert 'truncated' in formatter(Piecewise(*[(x**k, x < k) for k in range(400)]))
+    show_full(m)
+    assert '841' in capsys.readouterr().out
+    ip.calcpy.truncate_output = False
+    assert 'truncated' not in formatter(Add(*[x**k for k in range(1000)]))
+    ip.calcpy.truncate_output = True
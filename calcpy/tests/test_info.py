@@ -0,0 +1,108 @@
+def test_info(ip, capsys):
+    ip.run_cell('x**2-1?')
+    ip.calcpy._info_job.join()
+    out = capsys.readouterr().out
+    assert '= diff(_)' in out and '= factor(_, gaussian=True)' in out
+    # cancelled by the next cell:
+    ip.run_cell('x**2-1?')
+    ip.run_cell('1')
+    ip.calcpy._info_job.join()
+    assert '= diff(_)' not in capsys.readouterr().out
+    ip.calcpy.info_processes = 0
+    ip.run_cell('x**2-1?')
+    ip.calcpy._info_job.join()
+    assert '= diff(_)' in capsys.readouterr().out
+    ip.calcpy.info_processes = 2
+
+def test_info_output(ip, capsys):
+    from time import sleep
+    from calcpy.info import InfoOutput
+    show = lambda result, description: f'{result} = {description}'
+    output = InfoOutput([(description, None, (), show) for description in 'abc'], ip.calcpy._info_pool.generation)
+    output.on_result(1, (True, 2))
+    assert capsys.readouterr().out == '' # waits for a
+    output.on_result(0, (True, 1))
+    assert capsys.readouterr().out == '1 = a\n2 = b\n'
+    output.on_result(2, (True, 3))
+    assert capsys.readouterr().out == '3 = c\n'
+    # not waiting for long:
+    output = InfoOutput([(description, None, (), show) for description in 'ab'], ip.calcpy._info_pool.generation)
+    output.on_result(1, (True, 2))
+    sleep(1.5)
+    assert capsys.readouterr().out == '\n… = a\n2 = b\n'
+    output.finish([(False, 'timeout'), (True, 2)])
+    assert capsys.readouterr().out == '\na failed: timeout\n'
+    # cancelled:
+    output = InfoOutput([(description, None, (), show) for description in 'ab'], ip.calcpy._info_pool.generation)
+    ip.calcpy._info_pool.cancel()
+    output.on_result(0, (True, 1))
+    assert capsys.readouterr().out == ''
+
+def test_info_cache(ip, capsys, tmp_path):
+    from sympy import Matrix
+    from calcpy.infocache import InfoCache, info_key
+    from calcpy.info import FACTOR_BUDGET_RATIO
+    ip.run_cell('x**2-1?')
+    ip.calcpy._info_job.join()
+    out = capsys.readouterr().out
+    hits = ip.calcpy.cache_info()['info'].hits
+    ip.run_cell('x**2-1?')
+    ip.calcpy._info_job.join()
+    assert capsys.readouterr().out == out
+    assert ip.calcpy.cache_info()['info'].hits > hits
+    # symbol assumptions are part of the key:
+    assert info_key('diff(_)', (ip.run_cell('x').result,)) != info_key('diff(_)', (ip.run_cell('symbols("x", real=True)').result,))
+    ip.run_cell('del x')
+    # partial factorizations are not cached:
+    ip.calcpy.info_processes = 0
+    ip.calcpy.info_timeout = 0.5
+    n = (2**127-1)*(2**521-1)*(2**607-1)*5
+    ip.user_ns['n'] = n
+    ip.run_cell('n?')
+    ip.calcpy._info_job.join()
+    assert 'not factored in time' in capsys.readouterr().out
+    budget = ip.calcpy.info_timeout * FACTOR_BUDGET_RATIO
+    assert ip.calcpy._info_cache.get([info_key('factorint(_)', (n, budget))]) == {}
+    ip.run_cell('del n')
+    ip.calcpy.info_processes = 2
+    ip.calcpy.info_timeout = 10
+    cache = InfoCache(str(tmp_path / 'cache.sqlite'), 800)
+    cache.put('timeout', (False, 'timeout'))
+    for k in range(2):
+        cache.put(str(k), (True, Matrix(5, 5, lambda r, c: k*r*c)))
+    cache.get(['0'])
+    cache.put('2', (True, Matrix(5, 5, lambda r, c: 2*r*c)))
+    # least recently used evicted:
+    assert set(cache.get(['timeout', '0', '1', '2'])) == {1, 3}
+    assert cache.info().currsize <= 800
+    cache.close()
+
+def test_factor_integer():
+    from time import perf_counter
+    from calcpy.info import factor_integer
+    assert factor_integer(-23232, 1) == ({-1: 1, 2: 6, 3: 1, 11: 2}, {})
+    assert factor_integer((2**31-1)**3*1000003**2*3, 5) == ({3: 1, 1000003: 2, 2**31-1: 3}, {})
+    # partial, within the budget:
+    n = (2**127-1)*(2**521-1)*(2**607-1)*5
+    t = perf_counter()
+    factors, composites = factor_integer(n, 0.5)
+    assert perf_counter() - t < 1.5
+    assert factors == {5: 1} and composites == {n//5: 1}
+
+def test_info_numeric_matrix(ip, capsys):
+    from sympy import Matrix, Rational, symbols
+    from calcpy.info import numeric_array
+    ip.user_ns['m'] = Matrix(10, 10, lambda r, c: 1.5 if r == c else 0.25/(r+c+1))
+    ip.run_cell('m?')
+    ip.calcpy._info_job.join()
+    out = capsys.readouterr().out
+    assert '= np.linalg.det(_)' in out and '= np.linalg.eig(_)[0]' in out and '= _.eigenvects()' not in out
+    # exact rational, also symbolically:
+    ip.user_ns['m'] = Matrix.diag(*[Rational(1, k) for k in range(1, 11)])
+    ip.run_cell('m?')
+    ip.calcpy._info_job.join()
+    out = capsys.readouterr().out
+    assert '= np.linalg.det(_)' in out and '= det(_)' in out
+    ip.run_cell('del m')
+    assert numeric_array(Matrix(10, 10, lambda r, c: symbols('x')*r)) is None
+    assert numeric_array(Matrix([[1, 2j]])).dtype == complex
@@ -0,0 +1,31 @@
+from time import sleep
+from calcpy.pool import Pool
+
+def test_pool():
+    pool = Pool(2)
+    assert pool.map(pow, [(2, k) for k in range(10)]) == [(True, 2**k) for k in range(10)]
+    assert pool.map(int, [('1',), ('a',)])[1][0] == False
+    # timeout cancels running tasks, their workers are replaced:
+    assert pool.map(sleep, [(0,), (10,), (0,)], timeout=0.5) == [(True, None), (False, 'timeout'), (True, None)]
+    assert pool.map(pow, [(2, 3)]) == [(True, 8)]
+    assert all(worker.alive() for worker in pool.workers)
+    pool.close()
+    assert pool.workers == []
+
+def test_pool_run():
+    import threading
+    pool = Pool(2)
+    # each task has its own time limit:
+    assert pool.run([(sleep, (10,)), (sleep, (0.2,)), (sleep, (0.2,)), (pow, (2, 3))], task_timeout=1) == \
+        [(False, 'timeout'), (True, None), (True, None), (True, 8)]
+    threading.Timer(0.3, pool.cancel).start()
+    assert pool.run([(sleep, (10,)), (pow, (2, 3)), (sleep, (10,)), (sleep, (10,))]) == \
+        [(False, 'cancelled'), (True, 8), (False, 'cancelled'), (False, 'cancelled')]
+    generation = pool.generation
+    pool.cancel()
+    assert pool.run([(pow, (2, 3))], generation=generation) == [(False, 'cancelled')]
+    assert pool.run([(pow, (2, 3))], generation=pool.generation) == [(True, 8)]
+    assert all(worker.alive() for worker in pool.workers)
+    pool.close()
+    # without workers:
+    assert pool.run([(pow, (2, 3)), (int, ('a',))])[0] == (True, 8)
@@ -1,5 +1,6 @@
-from sympy import symbols, I
+from sympy import symbols, I, Matrix, Rational
 from datetime import datetime
+from calcpy import transformers
 
 def test_auto_date(ip):
     dt = ip.run_cell('d"today"-d"yesterday"').result
@@ -81,6 +82,20 @@ def test_auto_lambda(ip):
 
 def test_auto_matrix(ip):
     assert ip.run_cell('((1,0),(0,1)).det()').result == 1
+    assert ip.run_cell('((1,2.5),(x,-1/2))').result == Matrix(((1, Rational(5,2)), (symbols('x'), Rational(-1,2))))
+    assert ip.run_cell('(("a",1),(2,3))').result == (("a",1),(2,3))
+    assert ip.run_cell('((1,2),(3,))').result == ((1,2),(3,))
+    # elements of unknown type are evaluated once:
+    ip.run_cell('calls = []')
+    ip.run_cell('def f():\n calls.append(1)\n return 1')
+    assert ip.run_cell('m = ((f(),0),(0,1))\nm').result == Matrix(((1,0),(0,1)))
+    assert ip.run_cell('len(calls)').result == 1
+    # unless earlier statements of the cell might change them:
+    ip.run_cell('lst = [1]\nclass C: v = 1\nd = {"a": 1}')
+    assert ip.run_cell('lst.append(5)\n((lst[-1],0),(0,1))').result == Matrix(((5,0),(0,1)))
+    assert ip.run_cell('C.v = 7\n((C.v,0),(0,1))').result == Matrix(((7,0),(0,1)))
+    assert ip.run_cell('d["a"] = 9; ((d["a"],2),(3,4))').result == Matrix(((9,2),(3,4)))
+    ip.run_cell('del calls, f, m, lst, C, d')
 
 def test_auto_latex(ip):
     assert ip.run_cell('$\\frac{1}{2}$.evalf()').result == 0.5
@@ -111,6 +126,8 @@ def test_string_handling(ip):
     assert ip.run_cell('"2x \\"2x\\" 2x"').result == '2x "2x" 2x'
     assert ip.run_cell('"2x \\\'2x\\\' 2x"').result == '2x \'2x\' 2x'
     assert ip.run_cell("f'{2x} {{2x}} {2^2}'").result == '2*x {2x} 4'
+    assert ip.run_cell('("2x", "2x", $2$, $2$)').result == ('2x', '2x', 2, 2)
+    assert ip.run_cell(f'("(2x)", ({hash("(2x)")}))').result == ('(2x)', hash("(2x)"))
 
 def test_unicode_power(ip):
     assert ip.run_cell('x³').result == symbols('x') ** 3
@@ -118,3 +135,84 @@ def test_unicode_power(ip):
 
 def test_auto_solve(ip):
     assert ip.run_cell('x^2+2=11').result == [-3, 3]
+    # only the equation line:
+    assert ip.run_cell('a = 2\nx+a = 5').result == [3]
+    assert ip.run_cell('a').result == 2
+    assert ip.run_cell('x+y = 3 = 2x').result == {symbols('x'): Rational(3, 2), symbols('y'): Rational(3, 2)}
+    assert ip.run_cell('x+abs(-2) = "="').success == False
+    ip.run_cell('del a')
+
+def test_transform_cache(ip):
+    assert not ip.run_cell('2abc').success
+    ip.run_cell('abc = 3')
+    assert ip.run_cell('2abc').result == 6
+    transformers.raw_code_transformer('2abc')
+    hits = ip.calcpy.cache_info()['transform'].hits
+    assert transformers.raw_code_transformer('2abc') == '2*abc'
+    assert ip.calcpy.cache_info()['transform'].hits == hits + 1
+    ip.run_cell('del abc')
+    assert not ip.run_cell('2abc').success
+    # unit prefix status change:
+    assert ip.run_cell('2k').result == 2*symbols('k')
+    ip.calcpy.units_prefixes = True
+    assert ip.run_cell('2k').result == 2000
+    ip.calcpy.units_prefixes = False
+    assert ip.run_cell('2k').result == 2*symbols('k')
+
+def test_namespace_index(ip):
+    ip.run_cell('import fractions as abc, os.path')
+    assert {'abc', 'os'} <= ip.calcpy._ns_index.names
+    ip.run_cell('def abc(): pass')
+    ip.run_cell('for abc2 in range(2): pass')
+    assert ip.run_cell('2abc2').result == 2
+    ip.run_cell('exec("abc3 = 3")')
+    assert ip.run_cell('2abc3').result == 6
+    ip.run_cell('del abc, abc2, abc3')
+    assert not {'abc', 'abc2', 'abc3'} & ip.calcpy._ns_index.names
+    ip.run_cell('_q = 3')
+    assert ip.run_cell('2_q').result == 6
+    ip.run_cell('del _q')
+    # history names, not indexed:
+    n = ip.run_cell('7', store_history=True).execution_count
+    ip.run_cell('8', store_history=True)
+    assert ip.run_cell(f'2_{n}').result == 14
+    previous = ip.user_ns['__']
+    assert ip.run_cell('2__').result == 2*previous
+    assert not {'_', '_i', '_ii', '_1', '_oh'} & ip.calcpy._ns_index.names
+
+def test_code_cache(ip):
+    ip.run_cell('abc = 3')
+    assert ip.run_cell('abc/2').result == Rational(3, 2)
+    hits = ip.calcpy.cache_info()['code'].hits
+    assert ip.run_cell('abc/2').result == Rational(3, 2)
+    assert ip.calcpy.cache_info()['code'].hits == hits + 1
+    # type of name changed:
+    ip.user_ns['abc'] = 3.0
+    assert ip.run_cell('abc/2').result == 1.5
+    # assigned names are tracked also on hit:
+    ip.run_cell('del abc')
+    ip.run_cell('abc = 3')
+    ip.run_cell('del abc')
+    ip.run_cell('abc = 3')
+    assert ip.run_cell('2abc').result == 6
+    # traceback of current cell:
+    ip.run_cell('def f():\n raise ValueError')
+    filenames = []
+    for i in range(2):
+        hits = ip.calcpy.cache_info()['code'].hits
+        tb = ip.run_cell('f()', store_history=True).error_in_exec.__traceback__
+        filenames.append(tb.tb_next.tb_frame.f_code.co_filename)
+    assert ip.calcpy.cache_info()['code'].hits == hits + 1
+    assert filenames[0] != filenames[1]
+    ip.run_cell('del abc, f')
+
+def test_latex_cache(ip):
+    ip.run_cell('a = 3')
+    assert ip.run_cell('$a+\\frac{1}{2}$').result == Rational(7, 2)
+    hits = ip.calcpy.cache_info()['latex'].hits
+    ip.run_cell('a = 5')
+    assert ip.run_cell('$a+\\frac{1}{2}$').result == Rational(11, 2)
+    assert ip.calcpy.cache_info()['latex'].hits == hits + 1
+    ip.calcpy.auto_latex_sub = False
+    assert str(ip.run_cell('$a+\\frac{1}{2}$').result) == 'a + 1/2'
+    ip.run_cell('del a')
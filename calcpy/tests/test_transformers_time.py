@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import ast
+from time import perf_counter
+from calcpy.transformers import raw_code_transformer, _raw_code_transformer
+from calcpy.bench import LONG_CELLS
+
+def time_cell(transformer, code, n, cached=False):
+    elapsed = 0
+    for i in range(n):
+        if not cached:
+            _raw_code_transformer.cache_clear()
+        start_time = perf_counter()
+        transformer(code)
+        elapsed += perf_counter() - start_time
+    return elapsed / n
+
+def test_raw_code_transformer_time(ip, n=10):
+    for name, code in LONG_CELLS.items():
+        elapsed = time_cell(raw_code_transformer, code, n)
+        elapsed_cached = time_cell(raw_code_transformer, code, n, cached=True)
+        print(f'{name:<12} {len(code):>7} chars {1e3*elapsed:8.3f} ms/cell {1e3*elapsed_cached:8.3f} ms/cell (cached)')
+
+def test_ast_transformers_time(ip, n=10):
+    for name, code in LONG_CELLS.items():
+        code = raw_code_transformer(code)
+        elapsed = time_cell(lambda code: ip.transform_ast(ast.parse(code)), code, n, cached=True)
+        print(f'{name:<12} {len(code):>7} chars {1e3*elapsed:8.3f} ms/cell (ast)')
+
+if __name__ == "__main__":
+    from IPython.testing.globalipapp import start_ipython
+    ip = start_ipython()
+    ip.run_line_magic('load_ext', 'calcpy')
+    test_raw_code_transformer_time(ip)
+    test_ast_transformers_time(ip)
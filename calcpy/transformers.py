@@ -1,9 +1,15 @@
 import ast
+import collections
+import functools
+import io
+import itertools
 import re
+import tokenize
 import warnings
 import IPython
 import sympy
-import sympy.parsing.latex
+
+from . import formatters
 
 # Auxilary classes for manipulations
 class UnitPrefix():
@@ -32,15 +38,23 @@ def dateparse(datetime_string):
         raise ValueError(f'Could not parse "{datetime_string}" to datetime')
     return d
 
-def parse_latex(s):
-    ip = IPython.get_ipython()
+LATEX_CACHE_SIZE = 256
+
+@functools.lru_cache(maxsize=LATEX_CACHE_SIZE)
+def _parse_latex(s):
+    # before substitution of local variables. antlr is loaded on first use
+    import sympy.parsing.latex
     try:
         # don't take the default assumptions of symbols created by parser:
         sympy.Symbol._ignore_assumptions = True
         expr = sympy.parsing.latex.parse_latex(s)
     finally:
         sympy.Symbol._ignore_assumptions = False
-    expr = expr.subs({'i': sympy.I})
+    return expr.subs({'i': sympy.I})
+
+def parse_latex(s):
+    ip = IPython.get_ipython()
+    expr = _parse_latex(s)
     if not ip.calcpy.auto_latex_sub:
         return expr
     for sym in expr.free_symbols.copy():
@@ -50,226 +64,534 @@ def parse_latex(s):
             ip.push({sym.name: sym})
     return expr
 
+auto_symbol_idx_re = re.compile(r'_?\d+$')
+auto_symbol_letter_re = re.compile(r'[^\d\W]')
+greek_letters = {'alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta', 'iota', 'kappa', 'lamda',
+                 'mu', 'nu', 'xi', 'omicron', 'pi', 'rho', 'sigma', 'tau', 'upsilon', 'phi', 'chi', 'psi', 'omega'}
+
+@functools.lru_cache(maxsize=1024)
 def is_auto_symbol(var_name):
-    var_name_no_idx = re.sub(r'_?\d+$', '', var_name)
-    return re.fullmatch(r'[^\d\W]', var_name_no_idx) is not None or \
-        var_name_no_idx in ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta', 'iota', 'kappa', 'lamda',
-                            'mu', 'nu', 'xi', 'omicron', 'pi', 'rho', 'sigma', 'tau', 'upsilon', 'phi', 'chi', 'psi', 'omega']
+    var_name_no_idx = auto_symbol_idx_re.sub('', var_name)
+    return auto_symbol_letter_re.fullmatch(var_name_no_idx) is not None or var_name_no_idx in greek_letters
+
+var_pat = r'[^\d\W]\w*' # match any valid variable name
+superscripts = '⁰¹²³⁴⁵⁶⁷⁸⁹'
+# variable name following a number, stops before string modifiers (e.g. 2f"{x}").
+# may contain '°' and 'ⅈ', translated to 'deg' and 'i' before use
+prod_var_pat = rf'(?:(?![bdfr]{{0,2}}["\'])(?:[^\W{superscripts}]|°))+'
+# number - binary/octal/hex | engineering number | number
+num_pat = r'0[bBoOxX][0-9a-fA-F]*|\d*\.?\d+e-?\d+|\d*\.?\d+'
+# (string modifiers)("str"|'str'|"""str"""|'''str''')
+str_pat = r'(?P<str_mod>[bdfr]{0,2})(?P<str_body>"(?:\\"|[^"])+"|\'(?:\\\'|[^\'])+\'|"""[\S\s]*?(?<!\\)"""|\'\'\'[\S\s]*?(?<!\\)\'\'\')'
+cycle_pat = r'\((?:\d+ )+\d+\)'
+var_def_re = re.compile(rf'^({var_pat})\s*=(.*)', re.MULTILINE)
+fstring_expr_re = re.compile(r'(?<=(?<!{){)[^{}]*(?=}(?!}))')
+lr_quotation_marks_table = str.maketrans({'“': '"', '”': '"'})
+name_chars_table = str.maketrans({'°': 'deg', 'ⅈ': 'i'})
+superscripts_table = str.maketrans(superscripts, '0123456789')
+chars_replace = {'°': 'deg', '⋅': '*', '∙': '*', '•': '*', 'ⅈ': 'i'}
+
+@functools.lru_cache(maxsize=None)
+def _code_re(caret_power, auto_factorial, auto_sqrt, auto_permutation, auto_product, auto_latex, auto_lambda):
+    # all enabled rules in a single pattern, each rule is an outer named group (see match.lastgroup)
+    sqrt_pat = '√' if auto_sqrt else '(?!)'
+    prod_pat = f'{num_pat}|{prod_var_pat}|{sqrt_pat}'
+    def prod(name, pat=prod_pat):
+        # empty group, matched only when followed by implicit product
+        return rf'(?P<{name}>(?={pat}))?' if auto_product else ''
+
+    # (rule name, possible first characters, pattern)
+    rules = []
+    rules.append(('str', '"\'bdfr', str_pat + prod('str_prod')))
+    if auto_latex:
+        rules.append(('latex', '$', r'\$(?P<latex_body>[^$]*)\$' + prod('latex_prod')))
+    if auto_permutation:
+        rules.append(('cycle', '(', cycle_pat + prod('cycle_prod', f'{prod_pat}|{cycle_pat}')))
+    if auto_product:
+        # (format spec)?(number, not in the middle of a name)(var name|sqrt)
+        rules.append(('num', ':.0123456789', rf'(?P<num_skip>: *)?(?<![\w.°])(?P<num_val>(?>{num_pat}))(?P<num_var>{prod_var_pat}|(?={sqrt_pat}))'))
+        rules.append(('rparen', ')', rf'\)(?={prod_pat})'))
+    rules.append(('unicode_pow', '⁻' + superscripts, rf'(?P<unicode_pow_neg>⁻)?(?P<unicode_pow_val>[{superscripts}]+)' +
+                                 (rf'(?P<unicode_pow_var>{prod_var_pat}|(?={sqrt_pat}))?' if auto_product else '')))
+    rules.append(('char', ''.join(chars_replace), f'[{"".join(chars_replace)}]'))
+    if caret_power:
+        rules.append(('caret', '^', r'\^\^?'))
+    if auto_factorial:
+        rules.append(('factorial', '!', r'!(?!=)'))
+    if auto_sqrt:
+        rules.append(('sqrt', '√', '√'))
+
+    first_chars = re.escape(''.join(chars for name, chars, pat in rules))
+    code_pat = f'(?=[{first_chars}])(?:' + '|'.join(f'(?P<{name}>{pat})' for name, chars, pat in rules) + ')'
+    if auto_lambda:
+        code_pat = rf'(?P<lambda>\A(?P<lambda_name>{var_pat})\((?P<lambda_args>(?:{var_pat}\s*,?\s*)*)\)\s*:=(?=[^=]))|' + code_pat
+    return re.compile(code_pat)
+
+TRANSFORM_CACHE_SIZE = 512
 
 def calcpy_input_transformer_post(lines):
     return raw_code_transformer(''.join(lines)).splitlines(keepends=True)
 
+# ipython's output and input history names
+history_name_re = re.compile(r'_{1,3}|_\d+|_i+|_i\d+|_ih|_oh|_dh')
+history_product_re = re.compile(r'\d_')
+
+class NamespaceIndex():
+    # names the auto product cares about: defined names and unit prefixes, maintained incrementally
+    # (calcpy.push and names assigned by executed cells). version changes only when these change.
+    # ipython's history names (_, _i1, _1...) are not indexed (the auto product looks them up), other names
+    # starting with _ are
+    def __init__(self, user_ns):
+        self.user_ns = user_ns
+        self.names = set()
+        self.unit_prefixes = set()
+        self.version = 0
+        self.assigned_names = set() # by current cell, None if unknown (import *)
+        self.ns_len = 0
+        self.sync()
+
+    def update(self, names):
+        changed = False
+        for name in names:
+            if history_name_re.fullmatch(name):
+                continue
+            defined = name in self.user_ns
+            unit_prefix = defined and isinstance(self.user_ns[name], UnitPrefix)
+            if defined != (name in self.names) or unit_prefix != (name in self.unit_prefixes):
+                changed = True
+                if defined:
+                    self.names.add(name)
+                else:
+                    self.names.discard(name)
+                if unit_prefix:
+                    self.unit_prefixes.add(name)
+                else:
+                    self.unit_prefixes.discard(name)
+        if changed:
+            self.version += 1
+
+    def sync(self, names=()):
+        # catch also names set not through calcpy (exec, user_ns[...]=...), these are appended
+        # to the end of the namespace since last sync (dict keeps insertion order)
+        added = len(self.user_ns) - self.ns_len
+        if names is None or added < 0: # unknown names changed (import *, %reset...), check all
+            names = self.names | self.user_ns.keys()
+        else:
+            names = set(names).union(itertools.islice(reversed(self.user_ns), added))
+        self.update(names)
+        self.ns_len = len(self.user_ns)
+
+    def post_execute(self):
+        self.sync(self.assigned_names)
+        self.assigned_names = set()
+
+    def get_version(self):
+        if len(self.user_ns) != self.ns_len:
+            self.sync()
+        return self.version
+
+def raw_code_config(calcpy):
+    return (calcpy.fix_lr_quotation_marks, calcpy.caret_power, calcpy.auto_factorial, calcpy.auto_sqrt,
+            calcpy.auto_permutation, calcpy.auto_product, calcpy.auto_latex, calcpy.auto_lambda,
+            calcpy.auto_date, calcpy.auto_solve)
+
 def raw_code_transformer(code):
     ip = IPython.get_ipython()
-    var_pat = r'[^\d\W]\w*' # match any valid variable name
+    calcpy = ip.calcpy
+    # history names are not versioned (they change every cell), only the outputs count when these might be used
+    outputs = len(ip.user_ns.get('_oh', ())) if history_product_re.search(code) else 0
+    code = _raw_code_transformer(code, raw_code_config(calcpy), calcpy._ns_index.get_version(), outputs)
+
+    if calcpy._print_transformed_code:
+        print(code)
+    return code
 
-    if ip.calcpy.fix_lr_quotation_marks:
-        code = code.translate({ord(x): '"' for x in ['“', '”']})
+@functools.lru_cache(maxsize=TRANSFORM_CACHE_SIZE)
+def _raw_code_transformer(code, config, ns_version, outputs):
+    # ns_version and outputs are only part of the cache key
+    ip = IPython.get_ipython()
+    fix_lr_quotation_marks, caret_power, auto_factorial, auto_sqrt, auto_permutation, auto_product, auto_latex, \
+        auto_lambda, auto_date, auto_solve = config
 
-    user_vars = ip.user_ns.copy()
+    if fix_lr_quotation_marks:
+        code = code.translate(lr_quotation_marks_table)
+
+    ns_index = ip.calcpy._ns_index
     # consider also newly introduced variables:
-    var_def_pattern = rf'^({var_pat})\s*=(.*)'
-    for vars_match in re.finditer(var_def_pattern, code, re.MULTILINE):
-        user_vars.setdefault(vars_match[1], None)
-
-    # before doing anything, extract strings and latex, we don't want to transform these:
-    code_string_matches = {}
-    # (string modifiers)("str"|'str'|"""str"""|'''str''')
-    str_pat = r'([bdfr]{0,2})("(?:\\"|[^"])+"|\'(?:\\\'|[^\'])+\'|"""([\S\s]*?)(?<!\\)"""|\'\'\'([\S\s]*?)(?<!\\)\'\'\')'
-    for m in re.finditer(str_pat, code):
-        key = hash(m.group())
-        code = code.replace(m.group(), f'({key})')
-        if ip.calcpy.auto_date and m.group(1) == 'd':
-            code_string_matches[key] = 'dateparse(' + m.group(2) + ')'
-        elif 'f' in m.group(1): # recursive on f-strings
-            code_string_matches[key] = re.sub(r'(?<=(?<!{){)[^{}]*(?=}(?!}))', lambda match: raw_code_transformer(match[0]), m.group())
-        else:
-            code_string_matches[key] = m.group()
-
-    latex_matches = {}
-    latex_pattern = r'\$([^$]*)\$'
-    if ip.calcpy.auto_latex:
-        for m in re.finditer(latex_pattern, code):
-            key = hash(m.group())
-            code = code.replace(m.group(), f'({key})')
-            latex_matches[key] = f'parse_latex(r"""{m[1]}""")'
-
-    code = code.replace('°','deg')
-    code = code.replace('⋅','*')
-    code = code.replace('∙','*')
-    code = code.replace('•','*')
-    code = code.replace('ⅈ','i') # for auto product to detect it
-    u2i = {'\u2070':'0','\u00b9':'1','\u00b2':'2','\u00b3':'3','\u2074':'4','\u2075':'5','\u2076':'6','\u2077':'7','\u2078':'8','\u2079':'9'}
-    def unicode_pow_replace(match):
+    new_vars = {vars_match[1] for vars_match in var_def_re.finditer(code)}
+
+    def product(num, var):
+        if var == '': # followed by sqrt
+            return num + '*'
+        var = var.translate(name_chars_table)
+        # var not e (since 2e-4 is ambiguous)
+        if var.lower() == 'e':
+            return num + var
+        if var in ns_index.unit_prefixes:
+            return f'({num}*{var})'
+        if var in ns_index.names or var in new_vars or is_auto_symbol(var) or \
+           (history_name_re.fullmatch(var) and var in ip.user_ns):
+            return f'{num}*{var}'
+        return num + var
+
+    def prod_suffix(m, group):
+        return '*' if auto_product and m[group] is not None else ''
+
+    def str_rule(m):
+        if auto_date and m['str_mod'] == 'd':
+            s = 'dateparse(' + m['str_body'] + ')'
+        elif 'f' in m['str_mod']: # recursive on f-strings
+            s = fstring_expr_re.sub(lambda match: raw_code_transformer(match[0]), m['str'])
+        else: # strings are not transformed
+            s = m['str']
+        return s + prod_suffix(m, 'str_prod')
+
+    def num_rule(m):
+        if m['num_skip'] is not None:
+            return m['num'].translate(name_chars_table)
+        return product(m['num_val'], m['num_var'])
+
+    def unicode_pow_rule(m):
         s = '**'
-        if match[1]:
+        if m['unicode_pow_neg']:
             s += '-'
-        for c in match[2]:
-            s += u2i[c]
-        return s
-    unicode_pow_pat = f'(\u207b)?(({"|".join(u2i.keys())})+)'
-    code = re.sub(unicode_pow_pat, unicode_pow_replace, code)
-
-    if ip.calcpy.caret_power:
-        code = re.sub(r'(?<!\^)\^(?!\^)', '**', code)
-        code = code.replace('^^','^')
-
-    if ip.calcpy.auto_factorial:
-        code = re.sub(r'!(?!=)', r'**_factorial_pow', code)
-
-    if ip.calcpy.auto_sqrt:
-        code = code.replace('√','_sqrt_mul*')
-
-    if ip.calcpy.auto_permutation:
-        def cycle_replace(match):
-            return "sympy.combinatorics.Permutation(" + \
-                match[0].strip('()').replace(' ',',') + ")"
-        cycle_pat = r'\((\d+ )+\d+\)'
-        code = re.sub(cycle_pat, cycle_replace, code)
-
-    def auto_prod_replace(match):
-        # check var is not none, var not e (since 2e-4 is ambiguous), not a format specifier/middle of name
-        if match[3] is None or \
-           match[3].lower() == 'e' or \
-           match[1] is not None:
-            return match[0]
-        if match[3] in user_vars:
-            if getattr(user_vars[match[3]], 'is_unit_prefix', False):
-                return f'({match[2]}*{match[3]})'
-            else:
-                return f'{match[2]}*{match[3]}'
-        if is_auto_symbol(match[3]):
-            return f'{match[2]}*{match[3]}'
-
-        return match[0]
-
-    if ip.calcpy.auto_product:
-        # number - binary/octal/hex | engineering number | number
-        num_pat = r'0[bBoOxX][0-9a-fA-F]*|\d*\.?\d+e-?\d+|\d*\.?\d+'
-        # prod - (format spec|middle of name detection)?(number)(var name)?
-        prod_pat = rf'(: *|[^\d\W])?({num_pat})({var_pat})?'
-        code = re.sub(prod_pat, auto_prod_replace, code)
-
-        # pattern is (right parentheses)(binary/octal/hex | engineering number | number | var name)
-        prod_pat = rf'(\))(0[bBoOxX][0-9a-fA-F]*|\d*\.?\d+e-?\d+|\d*\.?\d+|{var_pat})'
-        code = re.sub(prod_pat, r'\1*\2', code)
-
-    for key, val in latex_matches.items():
-        code = code.replace(f'({key})', val)
-
-    for key, val in code_string_matches.items():
-        code = code.replace(f'({key})', val)
-
-    if ip.calcpy.auto_lambda:
-        lambda_pattern = rf'^({var_pat})\(((?:{var_pat}\s*,?\s*)*)\)\s*:=([^=].*)'
-        lambda_replace = r'\1= lambda \2 : \3'
-        code = re.sub(lambda_pattern, lambda_replace, code)
-
-    if ip.calcpy.auto_solve:
-        try:
-            ip.compile.ast_parse(code)
-        except Exception as e:
-            if isinstance(e, SyntaxError) and 'cannot assign to ' in str(e):
-                code = re.sub(r'(.*[^=])=([^=].*)', r'solve(Eq(\1, \2))', code)
+        num = m['unicode_pow_val'].translate(superscripts_table)
+        if auto_product and m['unicode_pow_var'] is not None:
+            return s + product(num, m['unicode_pow_var'])
+        return s + num
+
+    rules = {
+        'lambda': lambda m: f'{m["lambda_name"]}= lambda {m["lambda_args"]} : ',
+        'str': str_rule,
+        'latex': lambda m: f'parse_latex(r"""{m["latex_body"]}""")' + prod_suffix(m, 'latex_prod'),
+        'cycle': lambda m: 'sympy.combinatorics.Permutation(' + m['cycle'].strip('()').replace(' ',',') + ')' + \
+                           prod_suffix(m, 'cycle_prod'),
+        'num': num_rule,
+        'rparen': lambda m: ')*',
+        'unicode_pow': unicode_pow_rule,
+        'char': lambda m: chars_replace[m['char']],
+        'caret': lambda m: '^' if m['caret'] == '^^' else '**',
+        'factorial': lambda m: '**_factorial_pow',
+        'sqrt': lambda m: '_sqrt_mul*',
+    }
+    code_re = _code_re(caret_power, auto_factorial, auto_sqrt, auto_permutation, auto_product, auto_latex, auto_lambda)
+    code = code_re.sub(lambda m: rules[m.lastgroup](m), code)
+
+    if auto_solve:
+        code = auto_solve_transformer(ip, code)
 
-    if ip.calcpy._print_transformed_code:
-        print(code)
     return code
 
+def equation_sides(line):
+    # split on top level '=' (not in brackets or strings, not part of '==' etc.)
+    sides = []
+    depth = 0
+    start = 0
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(line).readline):
+            if token.type != tokenize.OP:
+                continue
+            if token.string in '([{':
+                depth += 1
+            elif token.string in ')]}':
+                depth -= 1
+            elif token.string == '=' and depth == 0:
+                sides.append(line[start:token.start[1]].strip())
+                start = token.end[1]
+    except (tokenize.TokenError, SyntaxError):
+        return []
+    sides.append(line[start:].strip())
+    return sides
+
+def auto_solve_transformer(ip, code):
+    # lines that assign to an expression are equations, 'a=b' to solve(Eq(a, b)), 'a=b=c' to solve([Eq(a, b), Eq(b, c)]).
+    # the parsed tree is handed to ipython, to not parse the cell twice (see init)
+    lines = code.splitlines(keepends=True)
+    for i in range(len(lines)):
+        try:
+            tree = ip.compile.ast_parse(code)
+        except SyntaxError as e:
+            if 'cannot assign to ' not in str(e) or not e.lineno or e.lineno > len(lines):
+                return code
+            line = lines[e.lineno-1]
+            sides = equation_sides(line)
+            if len(sides) < 2 or '' in sides:
+                return code
+            indent = line[:len(line) - len(line.lstrip())]
+            eqs = [f'Eq({lhs}, {rhs})' for lhs, rhs in zip(sides, sides[1:])]
+            eqs = eqs[0] if len(eqs) == 1 else '[' + ', '.join(eqs) + ']'
+            lines[e.lineno-1] = f'{indent}solve({eqs})' + line[len(line.rstrip('\r\n')):]
+            code = ''.join(lines)
+        except Exception:
+            return code
+        else:
+            ip.calcpy._parsed_code = (code, tree)
+            return code
+    return code
+
+def has_side_effects(stmt):
+    # statement might change objects (not only bind names), e.g. calls, attribute and subscript stores
+    if not isinstance(stmt, (ast.Assign, ast.AnnAssign, ast.AugAssign, ast.Expr, ast.Pass)):
+        return True
+    return any(isinstance(n, (ast.Call, ast.Await, ast.Yield, ast.YieldFrom)) or
+               (isinstance(n, (ast.Attribute, ast.Subscript)) and not isinstance(n.ctx, ast.Load))
+               for n in ast.walk(stmt))
+
 class AstNodeTransformer(ast.NodeTransformer):
     def __init__(self, ip):
         super().__init__()
         self.ip = ip
 
-class ReplaceIntegerDivisionWithRational(AstNodeTransformer):
+class CalcPyAstTransformer(AstNodeTransformer):
+    # all calcpy's ast transformations, in a single post-order pass (children are transformed first)
+    def visit_Module(self, node):
+        calcpy = self.ip.calcpy
+        self.auto_symbols = calcpy.auto_symbols
+        self.auto_rational = calcpy.auto_rational
+        self.auto_matrix = calcpy.auto_matrix
+        self.auto_product = calcpy.auto_product
+        self.user_ns = self.ip.user_ns
+        self.ns_index = calcpy._ns_index
+        self.nested = 0 # inside loop, function or comprehension
+        self.evaluated = False # result depends on evaluation (not only on the code and names types)
+        calcpy._trial_matrices.clear()
+        trial_matrices = self.trial_matrices = []
+        self.generic_visit(node)
+        # reuse matrices evaluated by the transformation, unless their names are assigned by the cell,
+        # or an earlier statement might change them (e.g. lst.append(5), d['a'] = 9)
+        reusable = set()
+        if trial_matrices:
+            for stmt in node.body:
+                reusable.update(map(id, ast.walk(stmt)))
+                if has_side_effects(stmt):
+                    break
+        for matrix_ast, key, names in trial_matrices:
+            if self.ns_index.assigned_names is not None and not names & self.ns_index.assigned_names and \
+               id(matrix_ast) in reusable:
+                matrix_ast.func = ast.Name(id='_trial_matrix', ctx=ast.Load())
+                matrix_ast.args = [ast.Constant(key)]
+        return node
+
+    @property
+    def cache_key(self):
+        # state the transformation depends on (see codecache)
+        calcpy = self.ip.calcpy
+        return (calcpy.auto_symbols, calcpy.auto_rational, calcpy.auto_matrix, calcpy.auto_product)
+
+    def generic_visit(self, node):
+        # ast.NodeTransformer.generic_visit, with cached visitor lookup
+        for field in node._fields:
+            old_value = getattr(node, field, None)
+            if isinstance(old_value, list):
+                new_values = []
+                for value in old_value:
+                    if isinstance(value, ast.AST):
+                        value = self.visitors[type(value)](self, value)
+                        if value is None:
+                            continue
+                        elif not isinstance(value, ast.AST):
+                            new_values.extend(value)
+                            continue
+                    new_values.append(value)
+                old_value[:] = new_values
+            elif isinstance(old_value, ast.AST):
+                new_node = self.visitors[type(old_value)](self, old_value)
+                if new_node is None:
+                    delattr(node, field)
+                else:
+                    setattr(node, field, new_node)
+        return node
+
+    def add_assigned(self, name):
+        # for namespace index
+        if self.ns_index.assigned_names is not None:
+            self.ns_index.assigned_names.add(name)
+
+    def visit_Name(self, node):
+        if self.auto_symbols and node.id not in self.user_ns and is_auto_symbol(node.id):
+            self.ip.calcpy.push({node.id: sympy.symbols(node.id)}, interactive=False)
+        if not isinstance(node.ctx, ast.Load):
+            self.add_assigned(node.id)
+        return node
+
+    def visit_nested(self, node):
+        self.nested += 1
+        self.generic_visit(node)
+        self.nested -= 1
+        return node
+
+    visit_For = visit_AsyncFor = visit_While = visit_Lambda = visit_nested
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = visit_nested
+
+    def visit_FunctionDef(self, node):
+        self.add_assigned(node.name)
+        return self.visit_nested(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+    visit_ClassDef = visit_FunctionDef
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            if alias.name == '*':
+                self.ns_index.assigned_names = None
+                return node
+            self.add_assigned(alias.asname or alias.name.split('.')[0])
+        return node
+
+    visit_ImportFrom = visit_Import
+
+    def visit_Constant(self, node):
+        if self.auto_rational and isinstance(node.value, float):
+            return ast.Call(func=ast.Name(id='Rational', ctx=ast.Load()),
+                            args=[ast.Call(func=ast.Name(id='repr', ctx=ast.Load()),
+                                           args=[node], keywords=[])],
+                            keywords=[])
+        return node
+
+    def is_integer(self, x):
+        if isinstance(x, ast.Constant) and isinstance(x.value, int):
+            return True
+        if isinstance(x, ast.Name) and isinstance(self.user_ns.get(x.id, None), int):
+            return True
+        if isinstance(x, ast.UnaryOp) and isinstance(x.op, (ast.USub, ast.UAdd)):
+            return self.is_integer(x.operand)
+        if isinstance(x, ast.BinOp) and isinstance(x.op, (ast.Add, ast.Sub, ast.Mult, ast.Pow)):
+            return self.is_integer(x.left) and self.is_integer(x.right)
+        return False
+
     def visit_BinOp(self, node):
-        def is_integer(x):
-            if isinstance(x, ast.Constant) and isinstance(x.value, int):
+        self.generic_visit(node)
+        # replace integer division with rational
+        if self.auto_rational and isinstance(node.op, ast.Div) and self.is_integer(node.left) and self.is_integer(node.right):
+            return ast.Call(func=ast.Name(id='Rational', ctx=ast.Load()),
+                            args=[node.left, node.right], keywords=[])
+        return node
+
+    def is_matrix_element(self, node):
+        # static check, True - sympy expression, False - not an expression, None - unknown
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool):
+                return None
+            return isinstance(node.value, (int, float, complex))
+        if isinstance(node, ast.Name):
+            if node.id not in self.user_ns:
+                return False
+            value = self.user_ns[node.id]
+            if isinstance(value, bool):
+                return None
+            if isinstance(value, (sympy.Expr, int, float, complex, FactorialPow, SqrtMul)):
                 return True
-            if isinstance(x, ast.Name) and isinstance(self.ip.user_ns.get(x.id, None), int):
+            return None
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            return self.is_matrix_element(node.operand)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.FloorDiv)):
+            left = self.is_matrix_element(node.left)
+            right = self.is_matrix_element(node.right)
+            if left is False or right is False:
+                return False
+            if left and right:
                 return True
-            if isinstance(x, ast.UnaryOp) and isinstance(x.op, (ast.USub, ast.UAdd)):
-                return is_integer(x.operand)
-            if isinstance(x, ast.BinOp) and isinstance(x.op, (ast.Add, ast.Sub, ast.Mult, ast.Pow)):
-                return is_integer(x.left) and is_integer(x.right)
+            return None
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and \
+           self.user_ns.get(node.func.id, None) is sympy.Rational:
+            return True
+        if isinstance(node, (ast.Tuple, ast.List, ast.Set, ast.Dict, ast.JoinedStr)):
             return False
+        return None
 
-        if self.ip.calcpy.auto_rational:
-            if (isinstance(node.op, ast.Div) and is_integer(node.left) and is_integer(node.right)):
-                return ast.Call(func=ast.Name(id='Rational', ctx=ast.Load()),
-                                args=[node.left, node.right], keywords=[])
-        return self.generic_visit(node)
-
-'''
-class ReplaceIntWithInteger(AstNodeTransformer):
-    def visit_Constant(self, node):
-        if isinstance(node.value, int):
-            return ast.Call(func=ast.Name(id='Integer', ctx=ast.Load()),
-                            args=[node], keywords=[])
-        return self.generic_visit(node)
-'''
+    def is_matrix(self, node):
+        # static check, True - matrix, False - not a matrix, None - unknown
+        if len(set(len(row.elts) for row in node.elts)) != 1:
+            return False
+        is_matrix = True
+        for row in node.elts:
+            for el in row.elts:
+                is_element = self.is_matrix_element(el)
+                if is_element is False:
+                    return False
+                if is_element is None:
+                    is_matrix = None
+        return is_matrix
 
-class ReplaceFloatWithRational(AstNodeTransformer):
-    def visit_Constant(self, node):
-        if self.ip.calcpy.auto_rational:
-            if isinstance(node.value, float):
-                return ast.Call(func=ast.Name(id='Rational', ctx=ast.Load()),
-                                args=[ast.Call(func=ast.Name(id='repr', ctx=ast.Load()),
-                                               args=[node], keywords=[])],
-                                keywords=[])
-        return self.generic_visit(node)
-
-class ReplaceTupleWithMatrix(AstNodeTransformer):
     def visit_Tuple(self, node):
+        self.generic_visit(node)
+        # replace tuple of tuples with matrix
         # skip empty tuples and non-nested tuples (e.g some functions uses tuples to represent ranges)
-        if not self.ip.calcpy.auto_matrix or \
+        if not self.auto_matrix or \
            len(node.elts) == 0 or \
            not all(isinstance(el, ast.Tuple) for el in node.elts):
-            return self.generic_visit(node)
+            return node
+
+        is_matrix = self.is_matrix(node)
+        if is_matrix is False:
+            return node
 
         matrix_ast = ast.Call(func=ast.Name(id='Matrix', ctx=ast.Load()), args=[node], keywords=[])
-        matrix_code = compile(ast.fix_missing_locations(ast.Expression(matrix_ast)), '<string>', 'eval')
+        if is_matrix:
+            return matrix_ast
 
+        # unknown element types, try to evaluate
+        self.evaluated = True
+        matrix_code = compile(ast.fix_missing_locations(ast.Expression(matrix_ast)), '<string>', 'eval')
         try:
             # sympy would warn if there is a non expression object, use this warning to fallback:
             with warnings.catch_warnings():
                 warnings.simplefilter("error")
                 matrix = self.ip.ev(matrix_code)
         except:
-            return self.generic_visit(node)
+            return node
 
+        if not self.nested:
+            key = len(self.ip.calcpy._trial_matrices)
+            self.ip.calcpy._trial_matrices[key] = matrix
+            names = {n.id for n in ast.walk(node) if isinstance(n, ast.Name)}
+            self.trial_matrices.append((matrix_ast, key, names))
         return matrix_ast
 
-class AutoSymbols(AstNodeTransformer):
-    def visit_Name(self, node):
-        if self.ip.calcpy.auto_symbols:
-            if node.id not in self.ip.user_ns and is_auto_symbol(node.id):
-                self.ip.calcpy.push({node.id: sympy.symbols(node.id)}, interactive=False)
-        return self.generic_visit(node)
-
-class AutoProduct(AstNodeTransformer):
     def visit_Call(self, node):
-        if self.ip.calcpy.auto_product and len(node.args) == 1 and node.keywords==[] and (
-           (isinstance(node.func, ast.Name) and isinstance(self.ip.user_ns.get(node.func.id, None), (sympy.Expr, int, float, complex))) or \
+        self.generic_visit(node)
+        # call of a number is a product
+        if self.auto_product and len(node.args) == 1 and node.keywords==[] and (
+           (isinstance(node.func, ast.Name) and isinstance(self.user_ns.get(node.func.id, None), (sympy.Expr, int, float, complex))) or \
            (isinstance(node.func, ast.Constant) and isinstance(node.func.value, (int, float, complex)))):
             return ast.BinOp(left=node.func, op=ast.Mult(), right=node.args[0])
-        return self.generic_visit(node)
+        return node
+
+# visitor per node type, avoid visit() method lookup for each node
+CalcPyAstTransformer.visitors = collections.defaultdict(lambda: CalcPyAstTransformer.generic_visit, {
+    node_type: getattr(CalcPyAstTransformer, 'visit_' + node_type.__name__)
+    for node_type in [ast.Module, ast.Name, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Import, ast.ImportFrom,
+                      ast.For, ast.AsyncFor, ast.While, ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp,
+                      ast.Constant, ast.BinOp, ast.Tuple, ast.Call]})
+
+def trial_matrix(key):
+    # matrix evaluated while transforming
+    return IPython.get_ipython().calcpy._trial_matrices[key]
 
 def init(ip: IPython.InteractiveShell):
+    ip.calcpy._ns_index = NamespaceIndex(ip.user_ns)
+    ip.events.register('post_execute', ip.calcpy._ns_index.post_execute)
+    ip.calcpy._trial_matrices = {}
+    ip.calcpy._parsed_code = None
     ip.calcpy.push({'_factorial_pow': FactorialPow(),
-                    '_sqrt_mul': SqrtMul()}, interactive=False)
+                    '_sqrt_mul': SqrtMul(),
+                    '_trial_matrix': trial_matrix}, interactive=False)
 
     # python might warn about the syntax hacks (on user's code)
     warnings.filterwarnings("ignore", category=SyntaxWarning)
 
-    ip.ast_transformers.append(AutoSymbols(ip))
-    ip.ast_transformers.append(ReplaceIntegerDivisionWithRational(ip))
-    # ip.ast_transformers.append(ReplaceIntWithInteger(ip))
-    ip.ast_transformers.append(ReplaceFloatWithRational(ip))
-    ip.ast_transformers.append(ReplaceTupleWithMatrix(ip))
-    ip.ast_transformers.append(AutoProduct(ip))
+    ip.ast_transformers.append(CalcPyAstTransformer(ip))
     ip.input_transformers_post.append(calcpy_input_transformer_post)
 
+    ast_parse = ip.compile.ast_parse
+    def calcpy_ast_parse(source, filename='<unknown>', symbol='exec'):
+        # reuse the tree parsed by auto solve
+        parsed, ip.calcpy._parsed_code = ip.calcpy._parsed_code, None
+        if parsed is not None and symbol == 'exec' and parsed[0] == source:
+            return parsed[1]
+        return ast_parse(source, filename, symbol)
+    ip.compile.ast_parse = calcpy_ast_parse
+
     # monkey patches
     # don't consider expressions as iterables: (see iterable() in sympy\utilities\iterables.py)
     sympy.Expr._iterable = False
@@ -303,6 +625,9 @@ def init(ip: IPython.InteractiveShell):
         if name not in sympy.Symbol._all_symbols:
             sympy.Symbol._all_symbols[name] = new_symbol
         elif not ignore_assumptions and not sympy.Symbol._ignore_assumptions:
+            if sympy.Symbol._all_symbols[name]._assumptions0 != new_symbol._assumptions0:
+                # evaluation depends on assumptions
+                formatters._evalf.cache_clear()
             sympy.Symbol._all_symbols[name]._assumptions = new_symbol._assumptions
             sympy.Symbol._all_symbols[name]._assumptions0 = new_symbol._assumptions0
             sympy.Symbol._all_symbols[name]._assumptions_orig = new_symbol._assumptions_orig
@@ -44,7 +44,7 @@ deg = MulUnitPrefix(Rational(1, 180), pi)
 
 # user functions:
 from calcpy.transformers import dateparse, parse_latex
-from calcpy.formatters import bin2int
+from calcpy.formatters import bin2int, show_full
 from calcpy.utils import copy
 from calcpy import get_calcpy
 
@@ -39,6 +39,10 @@ class DisableAssignments(ast.NodeTransformer):
         super().__init__()
         self.active = active
 
+    @property
+    def cache_key(self):
+        return self.active
+
     def visit_Assign(self, node):
         if self.active:
             return ast.Expr(node.value)